@@ -0,0 +1,130 @@
+import hashlib
+import os
+import shutil
+import tempfile
+
+
+# How the audio file is placed in the song folder:
+# reflink  - copy-on-write clone or in-kernel copy (copy_file_range) where the filesystem
+#            supports it, plain copy otherwise
+# hardlink - same file as the source (no extra space, edits show up on both sides)
+# symlink  - link to the source path (the source must stay where it is)
+# copy     - plain copy
+AUDIO_MODES = ("reflink", "hardlink", "symlink", "copy")
+DEFAULT_AUDIO_MODE = "reflink"
+
+_FICLONE = 0x40049409 # Linux ioctl: share all extents of one file with another
+_SAMPLE = 1024 * 1024 # Bytes hashed at each end of the file by the up-to-date check
+
+
+def place_audio(src: str, dest: str, mode: str = DEFAULT_AUDIO_MODE) -> bool:
+    """
+    Puts src at dest using `mode` (see AUDIO_MODES). Returns False when dest is already
+    up to date and nothing was written. A link that cannot be made (other filesystem,
+    no permission) falls back to a copy, and an identical copy already at dest is kept.
+    dest is replaced atomically, never left half written.
+    """
+    if mode not in AUDIO_MODES:
+        raise ValueError(f"Unknown audio mode: {mode} (expected {', '.join(AUDIO_MODES)})")
+    if is_up_to_date(src, dest, mode):
+        return False
+
+    folder = os.path.dirname(os.path.abspath(dest))
+    fd, tmp = tempfile.mkstemp(dir=folder, prefix=".song-", suffix=".tmp")
+    os.close(fd)
+    try:
+        link_mode = mode in ("hardlink", "symlink")
+        if not (link_mode and _link(src, tmp, mode)):
+            if link_mode and _same_copy(src, dest):
+                os.remove(tmp) # The copy a failed link falls back to is already there
+                return False
+            _copy(src, tmp, clone=mode == "reflink")
+        os.replace(tmp, dest)
+    except BaseException:
+        if os.path.lexists(tmp):
+            os.remove(tmp)
+        raise
+    return True
+
+
+def is_up_to_date(src: str, dest: str, mode: str = DEFAULT_AUDIO_MODE) -> bool:
+    """
+    Links must point at src. Copies must match its size and mtime (kept by every copy)
+    and the hash of its first and last megabyte, so a changed file is never missed
+    without reading hundreds of MB each run. In the link modes only a link counts:
+    place_audio tries to link first and keeps a copy only when that fails.
+    """
+    if os.path.islink(dest):
+        return mode == "symlink" and os.readlink(dest) == os.path.abspath(src)
+    if not os.path.exists(dest):
+        return False
+    if os.path.samefile(src, dest):
+        return mode == "hardlink" or os.path.abspath(src) == os.path.abspath(dest)
+    return mode not in ("hardlink", "symlink") and _same_copy(src, dest)
+
+
+def _same_copy(src: str, dest: str) -> bool:
+    # dest is a regular file with the size, mtime and sampled hash of src
+    if os.path.islink(dest) or not os.path.exists(dest):
+        return False
+    a, b = os.stat(src), os.stat(dest)
+    if a.st_size != b.st_size or a.st_mtime_ns != b.st_mtime_ns:
+        return False
+    return _sample_hash(src) == _sample_hash(dest)
+
+
+def _link(src: str, tmp: str, mode: str) -> bool:
+    os.remove(tmp) # os.link/os.symlink need a free name
+    try:
+        if mode == "hardlink":
+            os.link(src, tmp)
+        else:
+            os.symlink(os.path.abspath(src), tmp)
+        return True
+    except OSError:
+        open(tmp, "wb").close() # Fall back to a copy into the same name
+        return False
+
+
+def _copy(src: str, dest: str, clone: bool) -> None:
+    with open(src, "rb") as fin, open(dest, "wb") as fout:
+        if not (clone and _clone(fin, fout)):
+            fin.seek(fout.tell()) # After a partial in-kernel copy
+            shutil.copyfileobj(fin, fout, 1024 * 1024)
+    shutil.copystat(src, dest) # The mtime is part of the up-to-date check
+
+
+def _clone(fin, fout) -> bool:
+    # 1. Reflink: no data is copied at all
+    try:
+        import fcntl
+        fcntl.ioctl(fout.fileno(), _FICLONE, fin.fileno())
+        return True
+    except (ImportError, OSError):
+        pass
+
+    # 2. In-kernel copy: no round trip through user space, and a reflink on some filesystems.
+    # Both file offsets advance with it, so on failure the caller copies what is left.
+    if not hasattr(os, "copy_file_range"):
+        return False
+    remaining = os.fstat(fin.fileno()).st_size
+    try:
+        while remaining:
+            n = os.copy_file_range(fin.fileno(), fout.fileno(), remaining)
+            if n == 0:
+                return False
+            remaining -= n
+    except OSError:
+        return False
+    return True
+
+
+def _sample_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        digest.update(fh.read(_SAMPLE))
+        size = os.fstat(fh.fileno()).st_size
+        if size > _SAMPLE:
+            fh.seek(max(size - _SAMPLE, _SAMPLE))
+            digest.update(fh.read())
+    return digest.hexdigest()
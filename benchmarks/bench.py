@@ -0,0 +1,144 @@
+"""
+Offline conversion benchmarks on a synthetic MIDI corpus.
+
+    python -m benchmarks.bench                      # all presets, results in benchmarks/results/<commit>.json
+    python -m benchmarks.bench --presets large -r 10
+    python -m benchmarks.bench --compare benchmarks/results/abc1234.json
+
+Each preset song is converted `repeats` times with a fresh converter (no part or chart cache).
+process_song is timed without instrumentation; one more profiled run per repeat gives the
+per-stage breakdown (ingest, tempo, beat, drums, each difficulty, 5-lane parts, writes).
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+from converter import CHART_VERSION, MidiToYARGConverter
+from profiling import StageProfiler
+
+from .synth import PRESETS, write_corpus
+
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+METADATA = {"artist": "Synthetic", "diff_drums": "6", "diff_guitar": "6", "diff_bass": "6"}
+
+
+def bench_song(midi_path: str, output_dir: str, repeats: int, **options: Any) -> Dict[str, Any]:
+    """
+    Times process_song on one file: wall time stats plus median seconds per stage.
+    """
+    meta = dict(METADATA, name=os.path.splitext(os.path.basename(midi_path))[0])
+
+    totals = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        MidiToYARGConverter().process_song(midi_path, meta, output_dir, **options)
+        totals.append(time.perf_counter() - start)
+
+    profiler = StageProfiler(trace_memory=False)
+    for _ in range(repeats):
+        MidiToYARGConverter().process_song(midi_path, meta, output_dir, profiler=profiler, **options)
+
+    stages: Dict[str, List[float]] = {}
+    events: Dict[str, int] = {}
+    for song in profiler.songs:
+        for s in song["stages"]:
+            stages.setdefault(s["stage"], []).append(s["seconds"])
+            events[s["stage"]] = s["events"]
+
+    return {
+        "min_seconds": min(totals),
+        "median_seconds": statistics.median(totals),
+        "stages": {name: {"median_seconds": statistics.median(times), "events": events[name]}
+                   for name, times in stages.items()},
+    }
+
+
+def run(presets: List[str], repeats: int, quantize: bool = True) -> Dict[str, Any]:
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = write_corpus(os.path.join(tmp, "corpus"), {name: PRESETS[name] for name in presets})
+        output_dir = os.path.join(tmp, "output")
+
+        results = {}
+        for name, path in zip(presets, paths):
+            results[name] = bench_song(path, output_dir, repeats, quantize=quantize)
+            print(f"{name:<12} {results[name]['median_seconds'] * 1000:9.1f} ms (median of {repeats})", flush=True)
+
+    return {
+        "commit": _git_commit(),
+        "chart_version": CHART_VERSION,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "repeats": repeats,
+        "quantize": quantize,
+        "songs": results,
+    }
+
+
+def compare(base: Dict[str, Any], new: Dict[str, Any]) -> None:
+    """
+    Prints per song and per stage median changes from base to new (negative = faster).
+    """
+    print(f"\n{base['commit']} -> {new['commit']}")
+    for name, song in new["songs"].items():
+        old = base["songs"].get(name)
+        if not old:
+            continue
+        print(f"{name:<12} {_change(old['median_seconds'], song['median_seconds'])}")
+        for stage, timing in song["stages"].items():
+            if stage in old["stages"]:
+                print(f"  {stage:<14} {_change(old['stages'][stage]['median_seconds'], timing['median_seconds'])}")
+
+
+def _change(old: float, new: float) -> str:
+    pct = (new - old) / old * 100 if old else 0.0
+    return f"{old * 1000:9.2f} ms -> {new * 1000:9.2f} ms ({pct:+6.1f}%)"
+
+
+def _git_commit() -> str:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                             cwd=os.path.dirname(RESULTS_DIR), check=True)
+        return out.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark MIDI to chart conversion on a synthetic corpus.")
+    parser.add_argument("--presets", default=",".join(PRESETS),
+                        help=f"Comma separated presets (choices: {', '.join(PRESETS)})")
+    parser.add_argument("-r", "--repeats", type=int, default=5, help="Runs per song (default: %(default)s)")
+    parser.add_argument("--no-quantize", dest="quantize", action="store_false", help="Disable Auto-Quantize")
+    parser.add_argument("-o", "--output", help="Results file (default: benchmarks/results/<commit>.json)")
+    parser.add_argument("--compare", metavar="JSON", help="Previous results file to compare against")
+    options = parser.parse_args(argv)
+
+    presets = [p.strip() for p in options.presets.split(",") if p.strip()]
+    unknown = [p for p in presets if p not in PRESETS]
+    if unknown:
+        parser.error(f"unknown preset(s): {', '.join(unknown)}")
+
+    results = run(presets, options.repeats, options.quantize)
+
+    path = options.output or os.path.join(RESULTS_DIR, f"{results['commit']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as fh:
+        json.dump(results, fh, indent=2)
+    print(f"Results written to {path}")
+
+    if options.compare:
+        with open(options.compare, encoding="utf-8") as fh:
+            compare(json.load(fh), results)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,141 @@
+import os
+import random
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+
+import numpy as np
+from mido import Message, MetaMessage, MidiFile, MidiTrack
+
+from drumkits import load_kit
+from mappings import PROG_BASS_MIN, PROG_GUITAR_MIN
+
+
+@dataclass(frozen=True)
+class SynthSpec:
+    """
+    Shape of a synthetic General MIDI song. Same spec, same bytes: every
+    random choice comes from `seed`.
+    """
+    bars: int = 64
+    ticks_per_beat: int = 480
+    tracks: int = 2               # Melodic tracks; the first two are named Bass and Guitar
+    note_density: float = 2.0     # Notes per beat on each melodic track
+    drum_density: float = 4.0     # Channel 10 hits per beat (0 = no drum track)
+    tempo_changes: int = 8
+    time_signature_changes: int = 2
+    seed: int = 0
+
+
+# Corpus used by the benchmark runner, from a short song to a dense worst case
+PRESETS: Dict[str, SynthSpec] = {
+    "small": SynthSpec(bars=32, tracks=2, note_density=1.0, drum_density=2.0, tempo_changes=1, time_signature_changes=0),
+    "medium": SynthSpec(bars=96, tracks=3, note_density=2.0, drum_density=4.0, tempo_changes=8, time_signature_changes=2),
+    "large": SynthSpec(bars=256, tracks=6, note_density=3.0, drum_density=6.0, tempo_changes=40, time_signature_changes=6),
+    "dense_drums": SynthSpec(bars=128, tracks=1, note_density=1.0, drum_density=16.0, tempo_changes=4, time_signature_changes=1),
+    "tempo_map": SynthSpec(bars=128, tracks=2, note_density=2.0, drum_density=4.0, tempo_changes=1000, time_signature_changes=30),
+}
+
+_DRUM_NOTES = np.flatnonzero(load_kit("gm").mapped).tolist()
+_TIME_SIGNATURES = [(4, 4), (3, 4), (6, 8), (7, 8), (5, 4), (12, 8)]
+
+
+def generate(spec: SynthSpec) -> MidiFile:
+    """
+    Builds a Type 1 MidiFile: a conductor track with tempo/time signature changes,
+    `spec.tracks` melodic tracks and an optional channel 10 drum track.
+    Notes are humanized a little so quantization has work to do.
+    """
+    r = random.Random(spec.seed)
+    tpb = spec.ticks_per_beat
+    total = spec.bars * 4 * tpb
+
+    mid = MidiFile(type=1, ticks_per_beat=tpb)
+
+    # 1. Conductor track
+    meta = [(0, MetaMessage("set_tempo", tempo=500000)),
+            (0, MetaMessage("time_signature", numerator=4, denominator=4))]
+    for _ in range(spec.tempo_changes):
+        meta.append((r.randrange(1, total), MetaMessage("set_tempo", tempo=r.randint(300000, 900000))))
+    for _ in range(spec.time_signature_changes):
+        numerator, denominator = r.choice(_TIME_SIGNATURES)
+        bar = r.randrange(1, spec.bars)
+        meta.append((bar * 4 * tpb, MetaMessage("time_signature", numerator=numerator, denominator=denominator)))
+    mid.tracks.append(_to_track("Conductor", meta))
+
+    # 2. Melodic tracks (Bass, Guitar, then generic keys/pads)
+    for i in range(spec.tracks):
+        if i == 0:
+            name, program, low = "Bass", PROG_BASS_MIN, 28
+        elif i == 1:
+            name, program, low = "Guitar", PROG_GUITAR_MIN, 40
+        else:
+            name, program, low = f"Synth {i - 1}", 80 + i % 8, 48
+        notes = _melodic_notes(r, total, tpb, spec.note_density, low)
+        mid.tracks.append(_to_track(name, [], notes, channel=i % 9, program=program))
+
+    # 3. Drums (channel 10)
+    if spec.drum_density > 0:
+        mid.tracks.append(_to_track("Drums", [], _drum_notes(r, total, tpb, spec.drum_density), channel=9))
+
+    return mid
+
+
+def write_corpus(folder: str, specs: Dict[str, SynthSpec]) -> List[str]:
+    """
+    Writes one 'Synthetic - <name>.mid' per spec into folder and returns the paths.
+    """
+    os.makedirs(folder, exist_ok=True)
+    paths = []
+    for name, spec in specs.items():
+        path = os.path.join(folder, f"Synthetic - {name}.mid")
+        generate(spec).save(path)
+        paths.append(path)
+    return paths
+
+
+def _melodic_notes(r: random.Random, total: int, tpb: int, density: float, low: int) -> List[Tuple[int, int, int, int]]:
+    notes = []
+    step = max(int(tpb / max(density, 1e-3)), 1)
+    t = 0
+    while t < total:
+        length = r.choice([step // 2, step, step * 2])
+        chord = r.choice([1, 1, 1, 2, 3])
+        start = max(t + r.randint(-tpb // 16, tpb // 16), 0)
+        for note in r.sample(range(low, low + 24), chord):
+            notes.append((start, max(length - r.randint(0, tpb // 8), 1), note, r.randint(30, 127)))
+        t += r.choice([step // 2, step, step, step * 2])
+    return notes
+
+
+def _drum_notes(r: random.Random, total: int, tpb: int, density: float) -> List[Tuple[int, int, int, int]]:
+    notes = []
+    step = max(int(tpb / density), 1)
+    for t in range(0, total, step):
+        start = max(t + r.randint(-tpb // 24, tpb // 24), 0)
+        for note in r.sample(_DRUM_NOTES, r.choice([1, 1, 2, 2, 3])):
+            notes.append((start, tpb // 16, note, r.randint(20, 127)))
+    return notes
+
+
+def _to_track(name: str, meta: List[Tuple[int, MetaMessage]], notes: List[Tuple[int, int, int, int]] = (),
+              channel: int = 0, program: int = -1) -> MidiTrack:
+    """
+    Converts absolute (tick, message) meta events and (start, length, note, velocity)
+    notes into a delta-time MidiTrack. Offs sort before ons on the same tick.
+    """
+    events = [(tick, 0, msg) for tick, msg in meta]
+    for start, length, note, velocity in notes:
+        events.append((start, 2, Message("note_on", note=note, velocity=velocity, channel=channel)))
+        events.append((start + length, 1, Message("note_off", note=note, velocity=0, channel=channel)))
+    events.sort(key=lambda e: (e[0], e[1]))
+
+    track = MidiTrack()
+    track.append(MetaMessage("track_name", name=name, time=0))
+    if program >= 0:
+        track.append(Message("program_change", program=program, channel=channel, time=0))
+
+    last = 0
+    for tick, _, msg in events:
+        track.append(msg.copy(time=tick - last))
+        last = tick
+    return track
@@ -0,0 +1,123 @@
+import hashlib
+import json
+import os
+import tempfile
+from typing import Any, Dict, Optional, Tuple
+
+
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024 # 1 GB
+PRUNE_INTERVAL = 64 # Conversions finished by other processes between two prunes (see converted_elsewhere)
+
+
+class ChartCache:
+    """
+    Content-addressed on-disk cache of generated charts.
+
+    Entries are keyed by the hash of the MIDI bytes, the chart options and the converter
+    version, and store the encoded notes.mid plus a small JSON info header.
+    Reads refresh the entry mtime, so pruning evicts the least recently used entries first.
+    Several processes may share one cache folder: writes are atomic renames.
+    Worker processes get a copy of the cache, so their writes never add up to a prune:
+    the owner calls converted_elsewhere() for each of their results instead.
+    """
+
+    def __init__(self, root: str, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._written = 0 # Bytes written by this process since the last prune
+        self._elsewhere = 0 # Conversions finished by other processes since the last prune
+
+    def key(self, midi_bytes: bytes, options: Dict[str, Any], version: str) -> str:
+        digest = hashlib.sha256()
+        digest.update(version.encode("utf-8"))
+        digest.update(json.dumps(options, sort_keys=True).encode("utf-8"))
+        digest.update(midi_bytes)
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[Tuple[bytes, Dict[str, Any]]]:
+        """
+        Returns (notes_mid_bytes, info) or None on a miss.
+        """
+        path = self._path(key)
+        try:
+            with open(path, "rb") as fh:
+                data = fh.read()
+        except OSError:
+            return None
+        try:
+            header, notes = data.split(b"\n", 1)
+            info = json.loads(header)
+        except ValueError:
+            # Truncated or corrupt entry: a miss, rewritten by the next put
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass # Pruned by another process meanwhile
+        return notes, info
+
+    def put(self, key: str, notes: bytes, info: Dict[str, Any]) -> None:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        data = json.dumps(info).encode("utf-8") + b"\n" + notes
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as fh:
+                fh.write(data)
+            os.replace(tmp, path)
+        except OSError:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+        # Walking the whole cache on every write would be quadratic over a batch:
+        # prune once this process has written a tenth of the budget.
+        self._written += len(data)
+        if self._written >= self.max_bytes // 10:
+            self.prune()
+
+    def converted_elsewhere(self) -> None:
+        """
+        Counts a conversion that ran in another process with its own copy of this cache,
+        pruning every PRUNE_INTERVAL of them.
+        """
+        self._elsewhere += 1
+        if self._elsewhere >= PRUNE_INTERVAL:
+            self.prune()
+
+    def prune(self) -> None:
+        """
+        Deletes least recently used entries until the cache fits in max_bytes.
+        """
+        self._written = 0
+        self._elsewhere = 0
+        entries = []
+        total = 0
+        for dirpath, _, files in os.walk(self.root):
+            for f in files:
+                if not f.endswith(".chart"):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(dirpath, f))
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, os.path.join(dirpath, f)))
+                total += stat.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], f"{key}.chart")
@@ -0,0 +1,292 @@
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from typing import Any, Dict, List, Optional, Tuple
+
+from audio import AUDIO_MODES, DEFAULT_AUDIO_MODE
+from cache import DEFAULT_MAX_BYTES, ChartCache
+from converter import CHART_VERSION, MidiToYARGConverter, band_difficulty, metadata_from_filename
+from drumkits import DEFAULT_KIT, kit_names, load_kit
+from profiling import StageProfiler, aggregate
+from quantize import DEFAULT_GRIDS, GRIDS
+from watch import POLL_INTERVAL, SETTLE_TIME, FolderWatcher, options_key
+
+
+# Defaults (same as the GUI)
+DEFAULT_DIFFICULTY = 6
+DEFAULT_METADATA = {"album": "Unknown Album", "genre": "Rock", "year": "2026"}
+
+
+def collect_jobs(source: str, options: argparse.Namespace) -> List[Dict[str, Any]]:
+    """
+    Builds the job list from a folder of .mid files or from a JSON manifest.
+
+    Folder mode: every .mid below the folder is converted, metadata is guessed from
+    'Artist - Song' filenames and a sibling .ogg with the same name is used as audio.
+
+    Manifest mode: a JSON list of objects with a required "midi" key plus any of
+    "audio", "artist", "name", "album", "genre", "year", "diff_drums", "diff_guitar",
+    "diff_bass", "diff_rhythm", "diff_guitar_coop", "bass_idx", "guitar_idx", "drum_kit" and "parts"
+    (part -> source track index or list of indexes, see converter.FIVE_LANE_PARTS).
+    Relative paths are resolved against the manifest location.
+    """
+    entries = []
+    if os.path.isdir(source):
+        for root, _, files in os.walk(source):
+            for f in sorted(files):
+                if f.lower().endswith(".mid"):
+                    entries.append({"midi": os.path.relpath(os.path.join(root, f), source)})
+        base_dir = source
+    else:
+        with open(source, encoding="utf-8") as fh:
+            entries = json.load(fh)
+        base_dir = os.path.dirname(os.path.abspath(source))
+
+    return [make_job(entry, base_dir, options) for entry in entries]
+
+
+def make_job(entry: Dict[str, Any], base_dir: str, options: argparse.Namespace) -> Dict[str, Any]:
+    """
+    process_song arguments for one manifest entry (or {"midi": path} in folder mode).
+    """
+    midi_path = os.path.join(base_dir, entry["midi"])
+    audio_path = entry.get("audio")
+    if audio_path:
+        audio_path = os.path.join(base_dir, audio_path)
+    else:
+        sibling = os.path.splitext(midi_path)[0] + ".ogg"
+        audio_path = sibling if os.path.exists(sibling) else ""
+
+    meta = dict(DEFAULT_METADATA)
+    meta.update(metadata_from_filename(midi_path))
+    for key in ("artist", "name", "album", "genre", "year"):
+        if key in entry:
+            meta[key] = str(entry[key])
+
+    diffs = []
+    for inst in ("drums", "guitar", "bass"):
+        diff = int(entry.get(f"diff_{inst}", getattr(options, f"diff_{inst}")))
+        meta[f"diff_{inst}"] = str(diff)
+        diffs.append(diff)
+    meta["diff_band"] = band_difficulty(diffs)
+    for key in ("diff_rhythm", "diff_guitar_coop"):
+        if key in entry:
+            meta[key] = str(int(entry[key]))
+
+    parts = None
+    if "parts" in entry:
+        parts = {part: [int(i) for i in (idx if isinstance(idx, list) else [idx])]
+                 for part, idx in entry["parts"].items()}
+
+    return {
+        "midi_path": midi_path,
+        "metadata": meta,
+        "output_dir": options.output,
+        "quantize": options.quantize,
+        "quantize_grids": options.grids,
+        "include_ghosts": options.ghosts,
+        "bass_idx": int(entry.get("bass_idx", -1)),
+        "guitar_idx": int(entry.get("guitar_idx", -1)),
+        "audio_path": audio_path,
+        "shift_chart": options.count_in,
+        "parts": parts,
+        "audio_mode": options.audio_mode,
+        "drum_kit": entry.get("drum_kit", options.drum_kit),
+    }
+
+
+def convert_job(job: Dict[str, Any], cache: Optional[ChartCache] = None,
+                profile: bool = False, profile_memory: bool = False,
+                song_workers: int = 1) -> Tuple[str, bool, str, Optional[Dict[str, Any]]]:
+    """
+    Runs one conversion. Never raises: returns (midi_path, ok, folder or error message, profile)
+    so a single broken file does not abort the batch. profile is the song's stage report
+    when profiling is on and the conversion succeeded, else None.
+    profile_memory also records peak memory per stage (slows the conversion down).
+    song_workers processes build the instrument tracks (parts) of the song side by side.
+    """
+    profiler = StageProfiler(trace_memory=profile_memory) if profile else None
+    converter = MidiToYARGConverter(cache, workers=song_workers)
+    try:
+        folder = converter.process_song(**job, profiler=profiler)
+    except Exception as e:
+        if profiler:
+            profiler.close()
+        return job["midi_path"], False, f"{type(e).__name__}: {e}", None
+    finally:
+        converter.close()
+    return job["midi_path"], True, folder, profiler.songs[-1] if profiler else None
+
+
+def run_batch(jobs: List[Dict[str, Any]], workers: int, cache: Optional[ChartCache] = None,
+              profiles: Optional[List[Dict[str, Any]]] = None, profile_memory: bool = False,
+              song_workers: int = 0) -> int:
+    """
+    Converts every job, printing one status line per file as it finishes.
+    Each song builds its instrument tracks with song_workers processes; 0 gives every
+    song its share of the cores left over when there are fewer jobs than workers.
+    When a worker process dies (crash, out of memory) the songs it took down are
+    converted again on a new pool; the song that killed it is reported as failed.
+    When a profiles list is given, each song's stage report is appended to it
+    (with peak memory per stage when profile_memory is set).
+    Returns the number of failed conversions.
+    """
+    failed = 0
+    profile = profiles is not None
+    song_workers = song_workers or max(workers // max(len(jobs), 1), 1)
+
+    def report(result: Tuple[str, bool, str, Optional[Dict[str, Any]]]) -> None:
+        nonlocal failed
+        midi_path, ok, detail, song_profile = result
+        if song_profile is not None:
+            profiles.append(song_profile)
+        if ok:
+            print(f"[ok]   {midi_path} -> {detail}", flush=True)
+        else:
+            failed += 1
+            print(f"[fail] {midi_path}: {detail}", flush=True)
+
+    if workers <= 1:
+        for job in jobs:
+            report(convert_job(job, cache, profile, profile_memory, song_workers))
+    else:
+        def run_pool(indexes: List[int], max_workers: int) -> List[int]:
+            # Reports every song it converts; returns the unfinished ones if the pool broke
+            broken = []
+            with ProcessPoolExecutor(max_workers=max_workers) as pool:
+                futures = {pool.submit(convert_job, jobs[i], cache, profile, profile_memory, song_workers): i for i in indexes}
+                for future in as_completed(futures):
+                    try:
+                        report(future.result())
+                    except BrokenProcessPool:
+                        broken.append(futures[future])
+                        continue
+                    if cache:
+                        cache.converted_elsewhere()
+            return sorted(broken)
+
+        remaining = run_pool(list(range(len(jobs))), workers)
+        while remaining:
+            # Jobs are handed to the workers in order, at most workers + 1 at a time: the song
+            # that killed the pool is among the first unfinished ones. Run those alone to find it.
+            for i in remaining[:workers + 1]:
+                if run_pool([i], 1):
+                    report((jobs[i]["midi_path"], False, "BrokenProcessPool: the worker process died", None))
+            remaining = run_pool(remaining[workers + 1:], workers)
+
+    return failed
+
+
+def run_watch(options: argparse.Namespace, cache: Optional[ChartCache] = None) -> int:
+    """
+    Converts new and changed .mid files in options.source until interrupted (Ctrl+C).
+    """
+    if not os.path.isdir(options.source):
+        print(f"--watch needs a folder: {options.source}")
+        return 1
+
+    # Everything but the input paths: changing any of it converts the folder again
+    settings = make_job({"midi": ""}, "", options)
+    del settings["midi_path"], settings["audio_path"]
+    settings["version"] = CHART_VERSION
+    settings["drum_kit"] = load_kit(options.drum_kit).digest # Editing a kit file counts as a change
+
+    print(f"Watching {options.source} (Ctrl+C to stop)", flush=True)
+    watcher = FolderWatcher(
+        options.source, options.output,
+        make_executor=lambda: ProcessPoolExecutor(max_workers=max(options.jobs, 1)),
+        make_job=lambda path: make_job({"midi": path}, "", options),
+        convert=partial(convert_job, cache=cache, song_workers=options.song_workers or 1),
+        max_pending=options.jobs * 2, options_key=options_key(settings),
+        poll_interval=options.poll, settle_time=options.settle,
+        # Workers get a copy of the cache, so its size is only tracked here
+        on_result=cache.converted_elsewhere if cache else None)
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        print("Stopping, waiting for running conversions...", flush=True)
+    return 0
+
+
+def parse_grids(value: str) -> Tuple[str, ...]:
+    grids = tuple(g.strip() for g in value.split(",") if g.strip())
+    unknown = [g for g in grids if g not in GRIDS]
+    if unknown or not grids:
+        raise argparse.ArgumentTypeError(f"unknown grid(s): {value}")
+    return grids
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description="Batch convert General MIDI files into YARG/Clone Hero charts.")
+    parser.add_argument("source", help="Folder with .mid files, or a JSON manifest")
+    parser.add_argument("-o", "--output", default=os.path.join(os.getcwd(), "output"),
+                        help="Output directory (default: ./output)")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1,
+                        help="Number of worker processes (default: CPU count)")
+    parser.add_argument("--song-workers", type=int, default=0,
+                        help="Processes building the instrument tracks of each song side by side "
+                             "(default: the cores left over when there are fewer songs than --jobs; 1 in --watch)")
+    parser.add_argument("--no-quantize", dest="quantize", action="store_false",
+                        help="Disable Auto-Quantize")
+    parser.add_argument("--grids", type=parse_grids, default=DEFAULT_GRIDS,
+                        help=f"Comma separated quantize grids, coarse to fine (choices: {', '.join(GRIDS)}; default: {','.join(DEFAULT_GRIDS)})")
+    parser.add_argument("--ghosts", action="store_true", help="Include ghost notes")
+    parser.add_argument("--count-in", action="store_true", help="Add a 4-beat count-in section")
+    parser.add_argument("--cache-dir", help="Reuse charts of unchanged songs from this folder")
+    parser.add_argument("--profile", metavar="JSON",
+                        help="Write per-song and per-stage timings and event counts to this file")
+    parser.add_argument("--profile-memory", action="store_true",
+                        help="--profile: also record peak memory per stage (tracemalloc makes the timings several times slower)")
+    parser.add_argument("--cache-size", type=int, default=DEFAULT_MAX_BYTES // (1024 * 1024),
+                        help="Cache size limit in MB, least recently used charts are evicted first (default: %(default)s)")
+    parser.add_argument("--drum-kit", default=DEFAULT_KIT,
+                        help=f"Drum note layout of the source MIDI: {', '.join(kit_names())} or a kit .json file (default: %(default)s)")
+    parser.add_argument("--audio-mode", choices=AUDIO_MODES, default=DEFAULT_AUDIO_MODE,
+                        help="How song.ogg is placed: reflink (copy-on-write clone where supported, else copy), "
+                             "hardlink, symlink or copy. An up-to-date song.ogg is never rewritten (default: %(default)s)")
+    parser.add_argument("--watch", action="store_true",
+                        help="Keep running and convert .mid files as they are added to or changed in the source folder")
+    parser.add_argument("--poll", type=float, default=POLL_INTERVAL,
+                        help="--watch: seconds between folder scans (default: %(default)s)")
+    parser.add_argument("--settle", type=float, default=SETTLE_TIME,
+                        help="--watch: seconds a file must stay unchanged before it is converted (default: %(default)s)")
+    for inst in ("drums", "guitar", "bass"):
+        parser.add_argument(f"--diff-{inst}", type=int, default=DEFAULT_DIFFICULTY,
+                            help=f"{inst.capitalize()} difficulty 0-6, -1 disables (default: {DEFAULT_DIFFICULTY})")
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    options = build_parser().parse_args(argv)
+    if options.watch:
+        os.makedirs(options.output, exist_ok=True)
+        cache = ChartCache(options.cache_dir, options.cache_size * 1024 * 1024) if options.cache_dir else None
+        return run_watch(options, cache)
+
+    jobs = collect_jobs(options.source, options)
+    if not jobs:
+        print(f"No MIDI files found in {options.source}")
+        return 1
+
+    os.makedirs(options.output, exist_ok=True)
+    cache = ChartCache(options.cache_dir, options.cache_size * 1024 * 1024) if options.cache_dir else None
+    profiles = [] if options.profile else None
+    failed = run_batch(jobs, options.jobs, cache, profiles, options.profile_memory, options.song_workers)
+    if cache:
+        cache.prune()
+    if profiles is not None:
+        profiles.sort(key=lambda p: p["seconds"], reverse=True)
+        with open(options.profile, "w", encoding="utf-8") as fh:
+            json.dump({"songs": profiles, "stages": aggregate(profiles)}, fh, indent=2)
+        print(f"Profile written to {options.profile}")
+    print(f"Done: {len(jobs) - failed} converted, {failed} failed.")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,26 +1,291 @@
+import hashlib
 import os
-import shutil
-from collections import defaultdict
+import time
+from collections import OrderedDict, defaultdict
+from dataclasses import dataclass
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
 from pathlib import Path
-from typing import Any, Dict, List, Tuple
-
-from mido import Message, MetaMessage, MidiFile, MidiTrack
-
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set, Tuple, Union
+
+import numpy as np
+from mido import MetaMessage
+
+from audio import AUDIO_MODES, DEFAULT_AUDIO_MODE, place_audio
+from cache import ChartCache
+from detection import Candidate, detect_instruments
+from drumkits import CLASS_CYMBAL, CLASS_SPLASH, CLASS_TOM, DEFAULT_KIT, DrumKit, load_kit
+from ingest import SongEvents, TrackEvents, merge_tracks, parse_song, scan_song, summarize_track
+from profiling import StageProfiler
+from quantize import DEFAULT_GRIDS, Quantizer
+from smf import TrackWriter, encode_file
+from timing import TempoMap
 from mappings import (
-    BLUE_CYMBALS, BLUE_TOMS, DRUM_MAPPING, GREEN_CYMBALS,
-    GREEN_TOMS, IS_TOM, KICK_NOTES, PRIORITY_MAP, SPLASH_NOTE,
-    TOM_MARKERS_MAP,
     DRUM_BLUE, DRUM_GREEN, DRUM_YELLOW,
     GEM_GREEN, GEM_RED, GEM_YELLOW, GEM_BLUE, GEM_ORANGE,
-    BASE_EXPERT, BASE_HARD, BASE_MEDIUM, BASE_EASY,
-    PROG_BASS_MIN, PROG_BASS_MAX, PROG_GUITAR_MIN, PROG_GUITAR_MAX
+    BASE_EXPERT, BASE_HARD, BASE_MEDIUM, BASE_EASY
 )
 
 
 # Config
+CHART_VERSION = "3" # Bump whenever notes.mid output changes: part of the chart cache key
 NOTE_LEN = 1
+PART_CACHE_SIZE = 32 # Output tracks kept in memory for incremental re-conversions
+
+# 5-lane parts in output order: key -> (track name, song.ini difficulty key)
+FIVE_LANE_PARTS = {
+    "bass": ("PART BASS", "diff_bass"),
+    "guitar": ("PART GUITAR", "diff_guitar"),
+    "rhythm": ("PART RHYTHM", "diff_rhythm"),
+    "coop": ("PART GUITAR COOP", "diff_guitar_coop"),
+}
 MIN_VELOCITY = 40 # Notes below this are considered ghosts/noise unless ghosts are enabled
 
+# Chart events: one row per note_on/note_off (duration is set on the note_on row)
+KIND_OFF = 0
+KIND_ON = 1
+EVENT_DTYPE = np.dtype([
+    ("tick", np.int64),
+    ("kind", np.uint8),
+    ("note", np.uint8),
+    ("velocity", np.uint8),
+    ("duration", np.int32),
+])
+
+# Easy drums keep one lane per hit: Snare(1) > Green(4) > Blue(3) > Kick(0) > Yellow(2)
+_EASY_DRUM_RANK = np.array([3, 0, 4, 2, 1])
+
+
+def _note_events(ticks: np.ndarray, notes: np.ndarray, durations) -> np.ndarray:
+    """
+    Builds note_on/note_off pairs for the given gems, sorted by time.
+    On equal ticks note_offs come first, then note_ons in input order.
+    """
+    n = len(ticks)
+    events = np.zeros(2 * n, dtype=EVENT_DTYPE)
+    on, off = events[:n], events[n:]
+    on["tick"] = ticks
+    on["kind"] = KIND_ON
+    on["note"] = notes
+    on["velocity"] = 100
+    on["duration"] = durations
+    off["tick"] = ticks + durations
+    off["kind"] = KIND_OFF
+    off["note"] = notes
+
+    # Fixed length gems at sorted ticks are already two sorted runs
+    if np.isscalar(durations) and np.all(on["tick"][1:] >= on["tick"][:-1]):
+        return _merge_events(on, off)
+    return _sort_events(events)
+
+
+def _sort_events(events: np.ndarray) -> np.ndarray:
+    return events[np.lexsort((events["kind"], events["tick"]))]
+
+
+def _merge_events(*runs: np.ndarray) -> np.ndarray:
+    """
+    Stable k-way merge of event arrays already sorted by (tick, kind).
+    Same result as _sort_events(np.concatenate(runs)) without re-sorting: runs are
+    merged pairwise, each merge placing the right run with one binary search per event.
+    """
+    runs = list(runs)
+    if not runs:
+        return np.zeros(0, dtype=EVENT_DTYPE)
+    while len(runs) > 1:
+        merged = [_merge_two(runs[i], runs[i + 1]) for i in range(0, len(runs) - 1, 2)]
+        if len(runs) % 2:
+            merged.append(runs[-1])
+        runs = merged
+    return runs[0]
+
+
+def _merge_two(left: np.ndarray, right: np.ndarray) -> np.ndarray:
+    # On equal (tick, kind) left events stay first, like a stable sort of left + right
+    key_left = left["tick"].astype(np.int64) * 2 + left["kind"]
+    key_right = right["tick"].astype(np.int64) * 2 + right["kind"]
+    pos_right = np.searchsorted(key_left, key_right, side="right") + np.arange(len(right))
+
+    out = np.empty(len(left) + len(right), dtype=left.dtype)
+    is_left = np.ones(len(out), dtype=bool)
+    is_left[pos_right] = False
+    out[pos_right] = right
+    out[is_left] = left
+    return out
+
+
+def _group_rank(keys: np.ndarray) -> np.ndarray:
+    """
+    Position of each element inside its run of equal consecutive keys (0, 1, 2...).
+    """
+    idx = np.arange(len(keys))
+    run_start = np.ones(len(keys), dtype=bool)
+    run_start[1:] = keys[1:] != keys[:-1]
+    return idx - np.maximum.accumulate(np.where(run_start, idx, 0))
+
+
+@lru_cache(maxsize=4096)
+def _resolve_chord(kit: DrumKit, mask: int) -> Tuple[int, ...]:
+    """
+    Output gems, then tom markers, for one set of simultaneous drum hits (bit n = MIDI note n).
+    Cached: the same hit sets repeat all over a song and across the songs of a batch.
+    Includes Double-Cymbal logic:
+    - Splash(Yellow) + HiHat(Yellow) -> Splash moves to Green
+    - Blue Cymbal + Blue Cymbal -> Move one to Green
+    - Green Cymbal + Green Cymbal -> Move one to Blue
+    - Tom + Cymbal Collision -> Move Cymbal
+    """
+    raw_notes = [n for n in range(128) if mask >> n & 1]
+    gems = {n: int(kit.gem[n]) for n in raw_notes}
+    classes = {n: int(kit.note_class[n]) for n in raw_notes}
+
+    # Temporary storage to track occupied colors for this timestamp
+    notes_by_color = defaultdict(list)
+    for midi_n in raw_notes:
+        gem = gems[midi_n]
+
+        # --- Special Splash Logic ---
+        # If this is splash AND there is another yellow note (likely HH), move Splash to Green
+        if classes[midi_n] == CLASS_SPLASH and any(classes[n] != CLASS_SPLASH and gems[n] == DRUM_YELLOW for n in raw_notes):
+            gem = DRUM_GREEN
+        notes_by_color[gem].append(midi_n)
+
+    cymbals = {n for n in raw_notes if classes[n] == CLASS_CYMBAL}
+    toms = {n for n in raw_notes if classes[n] == CLASS_TOM}
+
+    # --- Double Cymbal Logic (Self-Collision) ---
+    # 2+ blue cymbals (e.g. Ride + Crash2): move the higher one (Crash2=57 usually > Ride=51) to Green
+    if sum(gems[n] == DRUM_BLUE for n in cymbals) > 1 and len(notes_by_color[DRUM_BLUE]) > 1:
+        note_to_move = max(notes_by_color[DRUM_BLUE])
+        notes_by_color[DRUM_BLUE].remove(note_to_move)
+        notes_by_color[DRUM_GREEN].append(note_to_move)
+
+    # 2+ Green Cymbals (Crash1 + China). Move one to Blue.
+    if sum(gems[n] == DRUM_GREEN for n in cymbals) > 1 and len(notes_by_color[DRUM_GREEN]) > 1:
+        note_to_move = max(notes_by_color[DRUM_GREEN])
+        notes_by_color[DRUM_GREEN].remove(note_to_move)
+        notes_by_color[DRUM_BLUE].append(note_to_move)
+
+    # --- Tom vs Cymbal Collision (Physical Impossibility) ---
+    green_tom_present = any(gems[n] == DRUM_GREEN for n in toms)
+    blue_tom_present = any(gems[n] == DRUM_BLUE for n in toms)
+
+    final_gems = set()
+    for gem, notes in notes_by_color.items():
+        for midi_n in notes:
+            # A Cymbal (by its kit color) on Green with a Green Tom moves to Blue, and the other way around
+            if gem == DRUM_GREEN and midi_n in cymbals and gems[midi_n] == DRUM_GREEN and green_tom_present:
+                final_gems.add(DRUM_BLUE)
+            elif gem == DRUM_BLUE and midi_n in cymbals and gems[midi_n] == DRUM_BLUE and blue_tom_present:
+                final_gems.add(DRUM_GREEN)
+            else:
+                final_gems.add(gem)
+
+    # --- Final Unique Filter --- (e.g. if logic moved everything to Green)
+    out = sorted(final_gems)
+
+    # Tom markers for every tom whose natural gem was written
+    for midi_n in raw_notes:
+        if midi_n in toms and gems[midi_n] in final_gems:
+            out.append(int(kit.marker[midi_n]))
+    return tuple(out)
+
+
+# progress(stage, fraction): called as each stage starts, with the fraction of stages already done
+ProgressCallback = Callable[[str, float], None]
+
+
+class ConversionCancelled(Exception):
+    """
+    Raised from a progress callback to abort the conversion in progress.
+    """
+
+
+class _Progress:
+    """
+    Counts stages and forwards them to the optional progress callback and profiler.
+    """
+
+    def __init__(self, callback: Optional[ProgressCallback], total: int, profiler: Optional[StageProfiler] = None):
+        self.callback = callback
+        self.profiler = profiler
+        self.total = max(total, 1)
+        self.done = 0
+        self._fraction = 0.0 # Never reported backwards when the total is re-estimated
+
+    def stage(self, name: str) -> None:
+        if self.callback:
+            self._fraction = max(self._fraction, min(self.done / self.total, 1.0))
+            self.callback(name, self._fraction)
+        if self.profiler:
+            self.profiler.stage(name)
+        self.done += 1
+
+    def count(self, events: int) -> None:
+        """
+        Events produced by the current stage (profiling only).
+        """
+        if self.profiler:
+            self.profiler.add_events(events)
+
+    def finish(self, cache_hit: bool = False) -> None:
+        if self.profiler:
+            self.profiler.end_song(cache_hit)
+        if self.callback:
+            self.callback("done", 1.0)
+
+
+@dataclass
+class ChartStats:
+    """
+    What a conversion produced. On a chart cache hit only instruments is known for
+    charts cached by older versions (the counts are then 0).
+    """
+    instruments: Tuple[str, ...] # "drums" and FIVE_LANE_PARTS keys, sorted
+    source_notes: int
+    chart_events: int
+    cache_hit: bool
+    seconds: float
+
+
+@dataclass
+class ChartResult:
+    """
+    An in-memory conversion: the contents of notes.mid and song.ini, and its stats.
+    """
+    notes: bytes
+    ini: str
+    stats: ChartStats
+
+
+def _run_builder(method: str, args: Tuple) -> Any:
+    """
+    Worker process entry point: builds one instrument track with a fresh converter.
+    """
+    return getattr(MidiToYARGConverter(), method)(*args, _Progress(None, 1))
+
+
+def metadata_from_filename(filename: str) -> Dict[str, str]:
+    """
+    Guesses Artist and Song from a filename following the 'Artist - Song' pattern.
+    """
+    base = os.path.splitext(os.path.basename(filename))[0]
+    if "-" in base:
+        artist, name = base.split("-", 1)
+        return {"artist": artist.strip(), "name": name.strip()}
+    return {"artist": "Unknown Artist", "name": base}
+
+
+def band_difficulty(difficulties: List[int]) -> str:
+    """
+    Band difficulty is the rounded average of the active instruments (difficulty >= 0).
+    Returns "-1" if every instrument is disabled.
+    """
+    active = [d for d in difficulties if d >= 0]
+    if not active:
+        return "-1"
+    return str(round(sum(active) / len(active)))
 
 
 class MidiToYARGConverter:
@@ -29,31 +294,88 @@ class MidiToYARGConverter:
     Includes logic for tempo mapping, beat generation, and strict limb-limit humanization.
     """
 
+    def __init__(self, cache: Optional[ChartCache] = None, workers: int = 1):
+        # Optional cache of finished charts (skips _create_chart for unchanged inputs)
+        self.cache = cache
+
+        # Processes used to build the instrument tracks of one song side by side (1 = serial).
+        # The pool is started on first use and kept for the next songs.
+        self.workers = workers
+        self._pool = None
+
+        # Last ingested song as (content hash, song). Lets the GUI convert
+        # the same file again (other options or tracks) without parsing it a second time.
+        self._last_song = None
+
+        # Output tracks of previous conversions, keyed by song + the inputs of each track
+        self._parts = OrderedDict()
+
+        # Drum kits by name, loaded once per converter so conversions never read kit files
+        # (the default one up front; use a new converter to pick up an edited kit file)
+        self._kits: Dict[str, DrumKit] = {DEFAULT_KIT: load_kit(DEFAULT_KIT)}
+
+    def close(self) -> None:
+        """
+        Stops the worker processes, if any were started.
+        """
+        if self._pool:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+
     def scan_tracks(self, midi_path: str) -> List[str]:
         """
         Scans the MIDI file and returns a list of track names prefixed with their index.
+        Uses the chunk-level track index, the song itself is only ingested on conversion.
         """
         try:
-            mid = MidiFile(midi_path)
-            track_names = []
-            for i, track in enumerate(mid.tracks):
-                name = "Untitled Track"
-                for msg in track:
-                    if msg.type == "track_name":
-                        name = msg.name
-                        break
-                track_names.append(f"{i}: {name}")
-            return track_names
+            return [f"{t.index}: {t.name}" for t in scan_song(midi_path)]
         except Exception:
             return []
 
+    def detect_tracks(self, midi_path: str) -> Dict[str, Optional[Candidate]]:
+        """
+        Tracks that auto-detection would use, as {"bass": Candidate or None, "guitar": ...}.
+        Same choice as process_song with bass_idx/guitar_idx left at -1.
+        """
+        try:
+            return detect_instruments(scan_song(midi_path))
+        except Exception:
+            return {"bass": None, "guitar": None}
+
+    def _load_song(self, source: bytes, data: bytes) -> SongEvents:
+        # Swapped as one tuple: the GUI may scan a file while its worker thread converts
+        last = self._last_song
+        if last is None or last[0] != source:
+            last = (source, parse_song(data))
+            self._last_song = last
+        return last[1]
+
+    def _source_key(self, data: bytes) -> bytes:
+        return hashlib.blake2b(data, digest_size=16).digest()
+
     def process_song(self, midi_path: str, metadata: Dict[str, Any], output_dir: str, 
                      quantize: bool = True, include_ghosts: bool = False,
                      bass_idx: int = -1, guitar_idx: int = -1,
-                     audio_path: str = "", shift_chart: bool = False) -> str:
+                     audio_path: str = "", shift_chart: bool = False,
+                     quantize_grids: Sequence[str] = DEFAULT_GRIDS,
+                     progress: Optional[ProgressCallback] = None,
+                     profiler: Optional[StageProfiler] = None,
+                     parts: Optional[Dict[str, Sequence[int]]] = None,
+                     audio_mode: str = DEFAULT_AUDIO_MODE, drum_kit: Union[str, DrumKit] = DEFAULT_KIT) -> str:
         """
-        Main pipeline entry point. Prepares directories and orchestrates track generation.
+        Main pipeline entry point. Prepares directories, places the audio and writes
+        notes.mid and song.ini from convert(). Returns the song folder.
+        audio_mode is how song.ogg is placed (see audio.AUDIO_MODES); an up-to-date song.ogg is kept.
+        The other options are those of convert().
         """
+        if audio_mode not in AUDIO_MODES:
+            raise ValueError(f"Unknown audio mode: {audio_mode} (expected {', '.join(AUDIO_MODES)})")
+        disabled, kit = self._check_options(metadata, parts, drum_kit)
+
+        tracker = _Progress(progress, 1 + self._stage_count(parts, disabled), profiler)
+        if profiler:
+            profiler.begin_song(midi_path)
+
         out_path = Path(output_dir)
         
         # Clean folder name
@@ -65,32 +387,136 @@ class MidiToYARGConverter:
         folder.mkdir(parents=True, exist_ok=True)
         
         # Handle Audio File
+        tracker.stage("audio")
         if audio_path and os.path.exists(audio_path):
             try:
-                dest = folder / "song.ogg"
-                shutil.copy2(audio_path, dest)
+                place_audio(audio_path, str(folder / "song.ogg"), audio_mode)
             except Exception as e:
-                print(f"Error copying audio file: {e}")
+                print(f"Error placing audio file: {e}")
 
-        # Check explicit disables from metadata (-1)
-        disable_drums = metadata.get('diff_drums') == "-1"
-        disable_guitar = metadata.get('diff_guitar') == "-1"
-        disable_bass = metadata.get('diff_bass') == "-1"
-
-        # Core generation
-        has_drums, has_bass, has_guitar = self._create_chart(
-            midi_path, str(folder / "notes.mid"), quantize, include_ghosts, 
-            bass_idx, guitar_idx,
-            disable_drums, disable_guitar, disable_bass, shift_chart
-        )
-        self._create_ini(metadata, folder, has_drums, has_bass, has_guitar)
+        result = self._convert(Path(midi_path).read_bytes(), metadata, tracker, disabled, quantize, include_ghosts,
+                               bass_idx, guitar_idx, shift_chart, quantize_grids, parts, kit)
+        (folder / "notes.mid").write_bytes(result.notes)
+        (folder / "song.ini").write_text(result.ini, encoding="utf-8")
+        tracker.finish(cache_hit=result.stats.cache_hit)
 
         return str(folder)
 
+    def convert(self, midi_data: bytes, metadata: Dict[str, Any],
+                quantize: bool = True, include_ghosts: bool = False,
+                bass_idx: int = -1, guitar_idx: int = -1, shift_chart: bool = False,
+                quantize_grids: Sequence[str] = DEFAULT_GRIDS,
+                progress: Optional[ProgressCallback] = None,
+                profiler: Optional[StageProfiler] = None,
+                parts: Optional[Dict[str, Sequence[int]]] = None,
+                drum_kit: Union[str, DrumKit] = DEFAULT_KIT, name: str = "<memory>") -> ChartResult:
+        """
+        Converts MIDI file bytes in memory: returns notes.mid bytes, song.ini text and stats,
+        without touching the filesystem (other than the chart cache, when one is set).
+        quantize_grids lists the candidate grids (see quantize.GRIDS) used when quantize is on.
+        progress is called as each stage starts; it may raise ConversionCancelled to stop.
+        profiler, when given, records time, events and memory of every stage, under `name`.
+        parts maps 5-lane parts (keys of FIVE_LANE_PARTS) to source track indexes, several
+        tracks being merged into one part. When given it replaces bass_idx/guitar_idx and auto-detection.
+        drum_kit is the drum note layout of the source (a kit name or .json file, see drumkits),
+        or an already loaded DrumKit. Other kits than the default are read on their first use.
+        """
+        disabled, kit = self._check_options(metadata, parts, drum_kit)
+        tracker = _Progress(progress, self._stage_count(parts, disabled), profiler)
+        if profiler:
+            profiler.begin_song(name)
+
+        result = self._convert(midi_data, metadata, tracker, disabled, quantize, include_ghosts,
+                               bass_idx, guitar_idx, shift_chart, quantize_grids, parts, kit)
+        tracker.finish(cache_hit=result.stats.cache_hit)
+        return result
+
+    def _check_options(self, metadata: Dict[str, Any], parts: Optional[Dict[str, Sequence[int]]],
+                       drum_kit: Union[str, DrumKit]) -> Tuple[Set[str], DrumKit]:
+        """
+        Validates parts and resolves drum_kit (kits named by string are loaded once per converter).
+        Returns the instruments disabled in metadata (-1) and the kit.
+        Track indexes are checked against the song once it is parsed (_create_chart).
+        """
+        unknown = sorted(set(parts or ()) - set(FIVE_LANE_PARTS))
+        if unknown:
+            raise ValueError(f"Unknown part(s): {', '.join(unknown)} (expected {', '.join(FIVE_LANE_PARTS)})")
+        for key, indexes in (parts or {}).items():
+            if any(i < 0 for i in indexes):
+                raise ValueError(f"Invalid track index for part '{key}': {list(indexes)}")
+        if isinstance(drum_kit, DrumKit):
+            kit = drum_kit
+        else:
+            kit = self._kits.get(drum_kit)
+            if kit is None:
+                kit = self._kits[drum_kit] = load_kit(drum_kit) # Raises ValueError for unknown kits
+
+        # Check explicit disables from metadata (-1)
+        disabled = {key for key in FIVE_LANE_PARTS if self._part_difficulty(metadata, key) == "-1"}
+        if metadata.get('diff_drums') == "-1":
+            disabled.add("drums")
+        return disabled, kit
+
+    def _part_difficulty(self, metadata: Dict[str, Any], key: str) -> Optional[str]:
+        """
+        Difficulty of a 5-lane part in metadata, None when not set.
+        Extra guitar parts (rhythm, co-op) default to the guitar difficulty.
+        """
+        diff_key = FIVE_LANE_PARTS[key][1]
+        if diff_key in metadata:
+            return str(metadata[diff_key])
+        return metadata.get("diff_guitar") if key in ("rhythm", "coop") else None
+
+    def _stage_count(self, parts: Optional[Dict[str, Sequence[int]]], disabled: Set[str]) -> int:
+        # ingest, tempo, beat, write + build, 3 reductions and write per instrument
+        # (5-lane parts are estimated here and counted exactly once picked)
+        expected = [key for key in (parts if parts is not None else ("bass", "guitar")) if key not in disabled]
+        return 4 + 5 * (len(expected) + ("drums" not in disabled))
+
+    def _convert(self, data: bytes, metadata: Dict[str, Any], tracker: _Progress, disabled: Set[str],
+                 quantize: bool, include_ghosts: bool, bass_idx: int, guitar_idx: int, shift_chart: bool,
+                 quantize_grids: Sequence[str], parts: Optional[Dict[str, Sequence[int]]],
+                 kit: DrumKit) -> ChartResult:
+        start = time.perf_counter()
+
+        # Everything that changes notes.mid (metadata only affects song.ini)
+        options = {
+            "quantize": quantize, "quantize_grids": list(quantize_grids), "include_ghosts": include_ghosts,
+            "bass_idx": bass_idx, "guitar_idx": guitar_idx, "shift_chart": shift_chart,
+            "disabled": sorted(disabled), "drum_kit": kit.digest,
+            "parts": {key: list(idx) for key, idx in parts.items()} if parts is not None else None,
+        }
+
+        cached = None
+        if self.cache:
+            cache_key = self.cache.key(data, options, CHART_VERSION)
+            cached = self.cache.get(cache_key)
+
+        if cached:
+            notes, info = cached
+        else:
+            # Core generation
+            notes, info = self._create_chart(
+                data, quantize, include_ghosts,
+                bass_idx, guitar_idx,
+                disabled, shift_chart, quantize_grids, tracker, parts, kit
+            )
+            if self.cache:
+                self.cache.put(cache_key, notes, info)
+
+        instruments = set(info["instruments"])
+        stats = ChartStats(tuple(sorted(instruments)), info.get("source_notes", 0), info.get("chart_events", 0),
+                           cached is not None, time.perf_counter() - start)
+        return ChartResult(notes, self._create_ini(metadata, instruments), stats)
+
     def _clean_name(self, text: str) -> str:
         return "".join(c for c in text if c.isalnum() or c in " -_.").strip()
 
-    def _create_ini(self, meta: Dict[str, Any], folder: Path, has_drums: bool = False, has_bass: bool = False, has_guitar: bool = False) -> None:
+    def _create_ini(self, meta: Dict[str, Any], instruments: Set[str]) -> str:
+        has_drums = "drums" in instruments
+        has_bass = "bass" in instruments
+        has_guitar = "guitar" in instruments
+
         lines = [
             "[song]",
             f"name = {meta.get('name', 'Unknown')}",
@@ -103,199 +529,279 @@ class MidiToYARGConverter:
             f"diff_band = {meta.get('diff_band', '-1')}",
             f"diff_guitar = {meta.get('diff_guitar', '-1') if has_guitar else '-1'}",
             f"diff_bass = {meta.get('diff_bass', '-1') if has_bass else '-1'}",
+        ]
+        for key in ("rhythm", "coop"):
+            if key in instruments:
+                lines.append(f"{FIVE_LANE_PARTS[key][1]} = {self._part_difficulty(meta, key) or '-1'}")
+        lines += [
             "charter = Midi to YARG Converter",
             "loading_phrase = Auto-generated by the Midi to YARG Converter",
         ]
-        (folder / "song.ini").write_text("\n".join(lines), encoding="utf-8")
+        return "\n".join(lines)
 
 
-    def _create_chart(self, input_path: str, output_path: str, quantize: bool, include_ghosts: bool,
+    def _create_chart(self, data: bytes, quantize: bool, include_ghosts: bool,
                       bass_idx_override: int = -1, guitar_idx_override: int = -1,
-                      disable_drums: bool = False, disable_guitar: bool = False, disable_bass: bool = False, 
-                      shift_chart: bool = False) -> Tuple[bool, bool, bool]:
+                      disabled: Set[str] = frozenset(),
+                      shift_chart: bool = False, quantize_grids: Sequence[str] = DEFAULT_GRIDS,
+                      progress: Optional[_Progress] = None,
+                      parts: Optional[Dict[str, Sequence[int]]] = None,
+                      kit: Optional[DrumKit] = None) -> Tuple[bytes, Dict[str, Any]]:
         """
         Rebuilds the MIDI structure. Uses Type 1 to allow separate Tempo and Instrument tracks.
-        Returns (has_drums, has_bass, has_guitar)
+        disabled holds "drums" and/or FIVE_LANE_PARTS keys to leave out.
+        kit is the drum note layout of the source (the default kit when None).
+        Returns (notes.mid bytes, info): info holds the instruments written ("drums" and
+        FIVE_LANE_PARTS keys), the source note count and the chart event count.
         """
-        mid_in = MidiFile(input_path)
-        mid_out = MidiFile(type=1, ticks_per_beat=mid_in.ticks_per_beat)
+        progress = progress or _Progress(None, 1)
+        kit = kit or load_kit()
+
+        progress.stage("ingest")
+        source = self._source_key(data)
+        song = self._load_song(source, data)
+        source_notes = sum(len(t.notes) for t in song.tracks)
+        progress.count(source_notes)
+        tpb = song.ticks_per_beat
+        tracks: List[TrackWriter] = []
 
         # Calculate Offset for Count-in (4 beats)
         offset_ticks = 0
         if shift_chart:
             # Shift by 4 beats (one measure in 4/4)
-            offset_ticks = mid_in.ticks_per_beat * 4
+            offset_ticks = tpb * 4
+
+        # Every output track is cached under its own inputs: changing only the bass
+        # track re-runs the bass pipeline and reuses the other tracks.
+        note_opts = (quantize, tuple(quantize_grids), include_ghosts, shift_chart)
 
         # 1. Build Tempo Map (Track 0)
-        tempo_events = self._build_tempo_track(mid_in, mid_out, offset_ticks)
+        progress.stage("tempo")
+        tempo_track, tempo_events = self._cached_part(
+            source, ("tempo", shift_chart), lambda: self._build_tempo_track(song, offset_ticks))
+        tempo_map = TempoMap(tempo_events, tpb)
+        tracks.append(tempo_track)
+        progress.count(tempo_track.events)
 
         # Calculate total song duration in ticks for the Beat Track
         # Add offset to total ticks to account for the shift
-        total_ticks = max((sum(m.time for m in t) for t in mid_in.tracks), default=0) + offset_ticks
+        total_ticks = song.total_ticks + offset_ticks
 
         # 2. Generate Beat Track (Visual grid/metronome)
-        self._create_beat_track(mid_out, total_ticks, mid_in.ticks_per_beat, tempo_events)
+        progress.stage("beat")
+        tracks.append(self._cached_part(
+            source, ("beat", shift_chart), lambda: self._create_beat_track(total_ticks, tpb, tempo_map)))
+        progress.count(tracks[-1].events)
 
-        # 3. Build Drums Track (Conditional)
-        has_drums = False
-        if not disable_drums:
-            drum_events = self._process_drums(mid_in, quantize, include_ghosts, offset_ticks)
-            
-            if drum_events:
-                has_drums = True
-                drum_track = MidiTrack()
-                mid_out.tracks.append(drum_track)
-                
-                # Standard YARG/CH track headers for Drums
-                for h in ["PART DRUMS", "[play]", "[music_start]"]:
-                    type_ = "track_name" if "PART" in h else "text"
-                    kw = "name" if "PART" in h else "text"
-                    drum_track.append(MetaMessage(type_, **{kw: h}, time=0))
-
-                # Generate Hard, Medium, Easy for Drums
-                hard_drums = self._reduce_difficulty(drum_events, BASE_EXPERT, BASE_HARD, "Hard", mid_in.ticks_per_beat, instrument="drums")
-                medium_drums = self._reduce_difficulty(hard_drums, BASE_HARD, BASE_MEDIUM, "Medium", mid_in.ticks_per_beat, instrument="drums")
-                easy_drums = self._reduce_difficulty(medium_drums, BASE_MEDIUM, BASE_EASY, "Easy", mid_in.ticks_per_beat, instrument="drums")
-
-                all_drums = drum_events + hard_drums + medium_drums + easy_drums
-                all_drums.sort(key=lambda x: x[0])
-                self._write_track(drum_track, all_drums)
-
-        # 4. Instrument Selection (Manual Override vs Auto-Detect)
-        if not disable_bass:
-            if bass_idx_override != -1:
-                bass_idx = bass_idx_override
-            else:
-                bass_idx = self._find_track_index(mid_in, "bass", PROG_BASS_MIN, PROG_BASS_MAX)
-        else:
-            bass_idx = -1
-
-        if not disable_guitar:
-            if guitar_idx_override != -1:
-                guitar_idx = guitar_idx_override
-            else:
-                guitar_idx = self._find_track_index(mid_in, "guitar", PROG_GUITAR_MIN, PROG_GUITAR_MAX)
-        else:
-            guitar_idx = -1
-
-        # 5. Build Bass Track
-        has_bass = False
-        if bass_idx != -1 and not disable_bass:
-            bass_track = MidiTrack()
-            mid_out.tracks.append(bass_track)
-            has_bass = True
-            
-            # Headers
-            bass_track.append(MetaMessage("track_name", name="PART BASS", time=0))
-            bass_track.append(MetaMessage("text", text="[play]", time=0))
-            bass_track.append(MetaMessage("text", text="[music_start]", time=0))
-
-            bass_events = self._process_5lane(mid_in.tracks[bass_idx], quantize, mid_in.ticks_per_beat, include_ghosts, tempo_events, offset_ticks)
-            
-            # Generate Lower Diffs
-            bass_hard = self._reduce_difficulty(bass_events, BASE_EXPERT, BASE_HARD, "Hard", mid_in.ticks_per_beat, instrument="5lane")
-            bass_medium = self._reduce_difficulty(bass_hard, BASE_HARD, BASE_MEDIUM, "Medium", mid_in.ticks_per_beat, instrument="5lane")
-            bass_easy = self._reduce_difficulty(bass_medium, BASE_MEDIUM, BASE_EASY, "Easy", mid_in.ticks_per_beat, instrument="5lane")
-            
-            all_bass = bass_events + bass_hard + bass_medium + bass_easy
-            all_bass.sort(key=lambda x: x[0])
-            self._write_track(bass_track, all_bass)
-
-        # 6. Build Guitar Track
-        has_guitar = False
-        if guitar_idx != -1 and not disable_guitar:
-            guitar_track = MidiTrack()
-            mid_out.tracks.append(guitar_track)
-            has_guitar = True
-            
-            # Headers
-            guitar_track.append(MetaMessage("track_name", name="PART GUITAR", time=0))
-            guitar_track.append(MetaMessage("text", text="[play]", time=0))
-            guitar_track.append(MetaMessage("text", text="[music_start]", time=0))
+        # Shared grid snapping for drums and guitar/bass (best grid per measure)
+        quantizer = None
+        if quantize:
+            measure_starts = [start for start, _ in tempo_map.bar_windows(total_ticks)]
+            quantizer = Quantizer(tpb, quantize_grids, measure_starts)
+
+        # 3. Instrument Selection (Explicit parts, Manual Override or Auto-Detect)
+        if parts is None:
+            parts = {}
+            detected = {}
+            if ("bass" not in disabled and bass_idx_override == -1) or ("guitar" not in disabled and guitar_idx_override == -1):
+                detected = detect_instruments([summarize_track(t) for t in song.tracks])
+            for key, override in (("bass", bass_idx_override), ("guitar", guitar_idx_override)):
+                if override != -1:
+                    parts[key] = [override]
+                elif detected.get(key):
+                    parts[key] = [detected[key].index]
+
+        for key, indexes in parts.items():
+            bad = [i for i in indexes if not 0 <= i < len(song.tracks)]
+            if bad and key not in disabled:
+                raise ValueError(f"Track index out of range for part '{key}': {bad} (song has {len(song.tracks)} tracks)")
+
+        # 4. Instrument Tracks: Drums (Conditional), then Bass, Guitar, Rhythm, Co-op
+        # Each job: (instrument, part cache key, builder method, builder args)
+        jobs = []
+        if "drums" not in disabled:
+            jobs.append(("drums", ("drums", kit.digest) + note_opts, "_build_drum_track",
+                         (song, quantizer, include_ghosts, offset_ticks, kit)))
+        for key in FIVE_LANE_PARTS:
+            if parts.get(key) and key not in disabled:
+                indexes = tuple(parts[key])
+                merged = merge_tracks([song.tracks[i] for i in indexes])
+                jobs.append((key, (key, indexes) + note_opts, "_build_5lane_track",
+                             (FIVE_LANE_PARTS[key][0], merged, quantizer, tpb, include_ghosts, tempo_map, offset_ticks)))
+
+        instruments = set()
+        for (instrument, *_), track in zip(jobs, self._build_instruments(source, jobs, progress)):
+            if track is not None: # No drum notes
+                instruments.add(instrument)
+                tracks.append(track)
+
+        progress.stage("write")
+        notes = encode_file(tpb, tracks)
+        chart_events = sum(t.events for t in tracks)
+        progress.count(chart_events)
+        return notes, {"instruments": sorted(instruments), "source_notes": source_notes, "chart_events": chart_events}
+
+    def _cached_part(self, source: bytes, key: Tuple, build: Callable[[], Any]) -> Any:
+        """
+        Returns the output part for key (scoped to the source file), building it on a miss.
+        Least recently used parts are dropped beyond PART_CACHE_SIZE.
+        """
+        key = (source,) + key
+        if key in self._parts:
+            self._parts.move_to_end(key)
+            return self._parts[key]
+
+        part = build()
+        self._store_part(key, part)
+        return part
+
+    def _store_part(self, key: Tuple, part: Any) -> None:
+        self._parts[key] = part
+        while len(self._parts) > PART_CACHE_SIZE:
+            self._parts.popitem(last=False)
+
+    def _build_instruments(self, source: bytes, jobs: List[Tuple[str, Tuple, str, Tuple]],
+                           progress: _Progress) -> List[Optional[TrackWriter]]:
+        """
+        Runs the instrument jobs built by _create_chart and returns their tracks in job order.
+        Jobs missing from the part cache run in the worker processes when there are several
+        of them (and workers > 1); each then reports one stage instead of one per difficulty.
+        The result does not depend on which job finishes first.
+        """
+        keys = [(source,) + key for _, key, _, _ in jobs]
+        missing = [i for i, k in enumerate(keys) if k not in self._parts]
+        parallel = self.workers > 1 and len(missing) > 1
 
-            # Re-use logic for Guitar
-            guitar_events = self._process_5lane(mid_in.tracks[guitar_idx], quantize, mid_in.ticks_per_beat, include_ghosts, tempo_events, offset_ticks)
-            
-            # Generate Lower Diffs
-            guitar_hard = self._reduce_difficulty(guitar_events, BASE_EXPERT, BASE_HARD, "Hard", mid_in.ticks_per_beat, instrument="5lane")
-            guitar_medium = self._reduce_difficulty(guitar_hard, BASE_HARD, BASE_MEDIUM, "Medium", mid_in.ticks_per_beat, instrument="5lane")
-            guitar_easy = self._reduce_difficulty(guitar_medium, BASE_MEDIUM, BASE_EASY, "Easy", mid_in.ticks_per_beat, instrument="5lane")
-            
-            all_guitar = guitar_events + guitar_hard + guitar_medium + guitar_easy
-            all_guitar.sort(key=lambda x: x[0])
-            self._write_track(guitar_track, all_guitar)
+        # Remaining stages: one per job (+ its difficulties when built here), then the final write
+        progress.total = progress.done + (len(jobs) if parallel else len(jobs) + 4 * len(missing)) + 1
 
-        mid_out.save(output_path)
-        return has_drums, has_bass, has_guitar
+        futures = {}
+        if parallel:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+            for i in missing:
+                _, _, method, args = jobs[i]
+                futures[i] = self._pool.submit(_run_builder, method, args)
 
-    def _find_track_index(self, mid: MidiFile, name_keyword: str, prog_min: int, prog_max: int) -> int:
+        try:
+            result = []
+            for i, (instrument, _, method, args) in enumerate(jobs):
+                progress.stage(instrument)
+                if keys[i] in self._parts:
+                    self._parts.move_to_end(keys[i])
+                    track = self._parts[keys[i]]
+                elif parallel:
+                    try:
+                        track = futures[i].result()
+                    except BrokenProcessPool:
+                        # A worker died: drop the pool (the next song starts a new one)
+                        # and build this job and the remaining ones here
+                        self.close()
+                        progress.total += 4 * sum(j >= i for j in futures)
+                        futures.clear()
+                        parallel = False
+                        track = getattr(self, method)(*args, progress)
+                    self._store_part(keys[i], track)
+                else:
+                    track = getattr(self, method)(*args, progress)
+                    self._store_part(keys[i], track)
+                if parallel and track is not None:
+                    progress.count(track.events)
+                result.append(track)
+            return result
+        finally:
+            for future in futures.values():
+                future.cancel() # Only still queued jobs, e.g. after a cancelled conversion
+
+    def _build_drum_track(self, song: SongEvents, quantizer: Optional[Quantizer], include_ghosts: bool, offset: int,
+                          kit: DrumKit, progress: _Progress) -> Optional[TrackWriter]:
         """
-        Helper to find track index by name or program change.
+        PART DRUMS with all four difficulties, or None if the song has no drum notes.
+        kit is the note layout of the source drums (see drumkits.load_kit).
         """
-        for i, track in enumerate(mid.tracks):
-            for msg in track:
-                if msg.type == "track_name" and name_keyword in msg.name.lower():
-                    return i
-                if msg.type == "program_change":
-                    if prog_min <= msg.program <= prog_max:
-                        return i
-        return -1
-
-    def _create_beat_track(self, mid: MidiFile, duration: int, ticks_per_beat: int, tempo_events: List[Tuple[int, MetaMessage]]) -> None:
+        tpb = song.ticks_per_beat
+        drum_events = self._process_drums(song, quantizer, include_ghosts, kit, offset)
+        progress.count(len(drum_events))
+        if not len(drum_events):
+            return None
+
+        # Standard YARG/CH track headers for Drums
+        drum_track = TrackWriter("PART DRUMS")
+        drum_track.text(0, "[play]")
+        drum_track.text(0, "[music_start]")
+
+        # Generate Hard, Medium, Easy for Drums
+        progress.stage("drums hard")
+        hard_drums = self._reduce_difficulty(drum_events, BASE_EXPERT, BASE_HARD, "Hard", tpb, instrument="drums")
+        progress.count(len(hard_drums))
+        progress.stage("drums medium")
+        medium_drums = self._reduce_difficulty(hard_drums, BASE_HARD, BASE_MEDIUM, "Medium", tpb, instrument="drums")
+        progress.count(len(medium_drums))
+        progress.stage("drums easy")
+        easy_drums = self._reduce_difficulty(medium_drums, BASE_MEDIUM, BASE_EASY, "Easy", tpb, instrument="drums")
+        progress.count(len(easy_drums))
+
+        progress.stage("drums write")
+        all_drums = _merge_events(drum_events, hard_drums, medium_drums, easy_drums)
+        self._write_track(drum_track, all_drums)
+        progress.count(drum_track.events)
+        return drum_track
+
+    def _build_5lane_track(self, part_name: str, source: TrackEvents, quantizer: Optional[Quantizer], tpb: int,
+                           include_ghosts: bool, tempo_map: TempoMap, offset: int, progress: _Progress) -> TrackWriter:
+        """
+        5-lane part (PART BASS / PART GUITAR) with all four difficulties.
+        """
+        # Headers
+        track = TrackWriter(part_name)
+        track.text(0, "[play]")
+        track.text(0, "[music_start]")
+
+        expert = self._process_5lane(source, quantizer, tpb, include_ghosts, tempo_map, offset)
+        progress.count(len(expert))
+
+        # Generate Lower Diffs
+        instrument = part_name.split()[-1].lower()
+        progress.stage(f"{instrument} hard")
+        hard = self._reduce_difficulty(expert, BASE_EXPERT, BASE_HARD, "Hard", tpb, instrument="5lane")
+        progress.count(len(hard))
+        progress.stage(f"{instrument} medium")
+        medium = self._reduce_difficulty(hard, BASE_HARD, BASE_MEDIUM, "Medium", tpb, instrument="5lane")
+        progress.count(len(medium))
+        progress.stage(f"{instrument} easy")
+        easy = self._reduce_difficulty(medium, BASE_MEDIUM, BASE_EASY, "Easy", tpb, instrument="5lane")
+        progress.count(len(easy))
+
+        progress.stage(f"{instrument} write")
+        self._write_track(track, _merge_events(expert, hard, medium, easy))
+        progress.count(track.events)
+        return track
+
+    def _create_beat_track(self, duration: int, ticks_per_beat: int, tempo_map: TempoMap) -> TrackWriter:
         """
         Generates the 'BEAT' track used by the game engine for grid alignment.
         """
-        track = MidiTrack()
-        track.append(MetaMessage("track_name", name="BEAT", time=0))
-        mid.tracks.append(track)
+        track = TrackWriter("BEAT")
 
-        # Default to 4/4 if no signature found
-        sigs = [(0, 4)]
-        for t, msg in tempo_events:
-            if msg.type == "time_signature":
-                sigs.append((t, msg.numerator))
-        sigs.sort(key=lambda x: x[0])
-
-        curr = 0
-        last = 0
-        idx = 0
-        beats_bar = sigs[0][1]
-        beat_count = 0
-
-        # Iterate through every beat in the song
-        while curr < duration:
-            # Update time signature if we passed a change event
-            if idx + 1 < len(sigs) and curr >= sigs[idx + 1][0]:
-                idx += 1
-                beats_bar = sigs[idx][1]
-                beat_count = 0
-
-            # MIDI Note 12 = Downbeat (Bar start), 13 = Standard beat
-            note = 12 if beat_count == 0 else 13
-            
-            track.append(Message("note_on", note=note, velocity=100, time=curr - last, channel=0))
-            track.append(Message("note_off", note=note, velocity=0, time=0, channel=0))
+        # MIDI Note 12 = Downbeat (Bar start), 13 = Standard beat
+        ticks, downbeats = tempo_map.beats(duration)
+        notes = np.where(downbeats, 12, 13)
 
-            last = curr
-            curr += ticks_per_beat
-            beat_count = (beat_count + 1) % beats_bar
+        # Each beat is a note_on immediately followed by its note_off
+        n = len(ticks)
+        track.notes(np.repeat(ticks, 2), np.tile([KIND_ON, KIND_OFF], n), np.repeat(notes, 2),
+                    np.tile([100, 0], n))
+        return track
 
-    def _build_tempo_track(self, mid_in: MidiFile, mid_out: MidiFile, offset: int = 0) -> List[Tuple[int, MetaMessage]]:
+    def _build_tempo_track(self, song: SongEvents, offset: int = 0) -> Tuple[TrackWriter, List[Tuple[int, MetaMessage]]]:
         """
         Extracts tempo events and builds the Tempo Map track.
+        Returns (tempo_track, tempo_events)
         """
-        tempo_track = MidiTrack()
-        tempo_track.name = "Tempo Map"
-        mid_out.tracks.append(tempo_track)
+        tempo_track = TrackWriter("Tempo Map")
 
-        tempo_events = []
-        abs_time = 0
-        
-        # Flatten track 0 events to absolute time
-        for msg in mid_in.tracks[0]:
-            abs_time += msg.time
-            if msg.type in ("set_tempo", "time_signature"):
-                tempo_events.append((abs_time, msg))
+        # Copy: the ingested song may be reused by a later conversion
+        tempo_events = list(song.tempo_events)
 
         # Shift logic
         if offset > 0:
@@ -323,189 +829,91 @@ class MidiToYARGConverter:
             tempo_events = shifted_events
 
         # Write to track
-        last_t = 0
         # Sort to ensure order
         tempo_events.sort(key=lambda x: x[0])
-        
+
         for t, msg in tempo_events:
-            delta = t - last_t
-            if delta < 0: delta = 0
-            tempo_track.append(msg.copy(time=delta))
-            last_t = t
+            if msg.type == "set_tempo":
+                tempo_track.set_tempo(t, msg.tempo)
+            else:
+                tempo_track.time_signature(t, msg.numerator, msg.denominator,
+                                           msg.clocks_per_click, msg.notated_32nd_notes_per_beat)
             
-        return tempo_events
+        return tempo_track, tempo_events
 
-    def _process_drums(self, mid_in: MidiFile, quantize: bool, include_ghosts: bool, offset: int = 0) -> List[Tuple[int, str, int, int]]:
+    def _process_drums(self, song: SongEvents, quantizer: Optional[Quantizer], include_ghosts: bool, kit: DrumKit, offset: int = 0) -> np.ndarray:
         """
         Orchestrates the drum processing pipeline: Quantize (Optional) -> Humanize -> Conflict Resolve.
         """
-        if quantize:
-            timeline = self._quantize_events(mid_in, include_ghosts, offset)
+        if quantizer:
+            timeline = self._quantize_events(song, quantizer, include_ghosts, kit, offset)
         else:
-            timeline = self._get_raw_events(mid_in, include_ghosts, offset)
-        self._humanize_timeline(timeline)
-        return self._resolve_conflicts(timeline)
+            timeline = self._get_raw_events(song, include_ghosts, kit, offset)
+        timeline = self._humanize_timeline(timeline, kit)
+        return self._resolve_conflicts(timeline, kit)
 
-    def _quantize_events(self, mid_in: MidiFile, include_ghosts: bool, offset: int = 0) -> Dict[int, List[int]]:
+    def _drum_hits(self, song: SongEvents, include_ghosts: bool, kit: DrumKit, offset: int = 0) -> np.ndarray:
         """
-        Reads MIDI tracks and snaps notes to the nearest grid.
+        Collects mapped drum notes (Channel 10) from every track, shifted by offset.
         """
-        timeline = defaultdict(list)
-        tpb = mid_in.ticks_per_beat
-        
-        # Config: Snap tolerance 11% (This is the value that worked well for most songs)
-        # Grid: 1/8 notes (Eighth notes) -> tpb / 2 
-        # (Standard beat is 1/4 note, so half a beat is 1/8)
-        tolerance_ticks = tpb * 0.11
-        anchor_grid = tpb / 2
-        
         threshold = 1 if include_ghosts else MIN_VELOCITY
 
-        for track in mid_in.tracks:
-            abs_t = offset
-            for msg in track:
-                abs_t += msg.time
-                if (msg.type == "note_on" and msg.channel == 9):
-                    if msg.velocity >= threshold and msg.note in DRUM_MAPPING:
-                        # Grid snapping
-                        nearest = round(abs_t / anchor_grid) * anchor_grid
-                        final_time = int(nearest) if abs(abs_t - nearest) <= tolerance_ticks else abs_t
-                        timeline[final_time].append(msg.note)
-        return timeline
+        hits = song.channel_notes(9)
+        hits = hits[(hits["velocity"] >= threshold) & kit.mapped[hits["note"]]]
+        hits["tick"] += offset
+        return hits
 
-    def _get_raw_events(self, mid_in: MidiFile, include_ghosts: bool, offset: int = 0) -> Dict[int, List[int]]:
+    def _quantize_events(self, song: SongEvents, quantizer: Quantizer, include_ghosts: bool, kit: DrumKit, offset: int = 0) -> np.ndarray:
+        """
+        Reads MIDI tracks and snaps notes to the nearest grid.
+        Returns the drum timeline: hits sorted by (snapped) time.
+        """
+        timeline = self._drum_hits(song, include_ghosts, kit, offset)
+        timeline["tick"] = quantizer.snap(timeline["tick"])
+        return timeline[np.argsort(timeline["tick"], kind="stable")]
+
+    def _get_raw_events(self, song: SongEvents, include_ghosts: bool, kit: DrumKit, offset: int = 0) -> np.ndarray:
         """
         Reads MIDI tracks and extracts notes without snapping to grid.
         """
-        timeline = defaultdict(list)
-        
-        threshold = 1 if include_ghosts else MIN_VELOCITY
-        
-        for track in mid_in.tracks:
-            abs_t = offset
-            for msg in track:
-                abs_t += msg.time
-                if (msg.type == "note_on" and msg.channel == 9):
-                    if msg.velocity >= threshold and msg.note in DRUM_MAPPING:
-                        timeline[abs_t].append(msg.note)
-        return timeline
-
-    def _resolve_conflicts(self, timeline: Dict[int, List[int]]) -> List[Tuple[int, str, int, int]]:
-        """
-        Converts timeline to events and resolves color collisions.
-        Includes Double-Cymbal logic: 
-        - Splash(Yellow) + HiHat(Yellow) -> Splash moves to Green
-        - Blue Cymbal + Blue Cymbal -> Move one to Green
-        - Green Cymbal + Green Cymbal -> Move one to Blue
-        - Tom + Cymbal Collision -> Move Cymbal
-        """
-        final_events = []
-
-        for t in sorted(timeline.keys()):
-            raw_notes = set(timeline[t])
-            
-            # Temporary storage to track occupied colors for this timestamp
-            notes_by_color = defaultdict(list)
-
-            for midi_n in raw_notes:
-                gem = DRUM_MAPPING[midi_n]
-                
-                # --- Special Splash Logic ---
-                # If this is splash AND there is another yellow note (likely HH), move Splash to Green
-                if midi_n == SPLASH_NOTE:
-                    # check if any OTHER note maps to yellow
-                    other_yellows = [n for n in raw_notes if n != SPLASH_NOTE and DRUM_MAPPING[n] == DRUM_YELLOW]
-                    if other_yellows:
-                        gem = DRUM_GREEN
-
-                notes_by_color[gem].append(midi_n)
-            
-            # --- Double Cymbal Logic (Self-Collision) ---
-            # If we have > 1 note mapping to Blue or Green, we might need to split them
-            
-            # Check Blue Cymbals Collision
-            blue_cymbals = [n for n in raw_notes if n in BLUE_CYMBALS]
-            if len(blue_cymbals) > 1:
-                # We have 2+ blue cymbals (e.g. Ride + Crash2). Move the second one to Green.
-                # Find which notes are mapped to Blue currently
-                current_blues = notes_by_color[DRUM_BLUE]
-                if len(current_blues) > 1:
-                    # Move one of them (e.g. the last one found or specifically the crash)
-                    # Simple heuristic: Move the one with higher pitch (Crash2=57 usually > Ride=51)
-                    note_to_move = max(current_blues) 
-                    
-                    # Update mapping for this instance
-                    # Remove from blue list
-                    notes_by_color[DRUM_BLUE].remove(note_to_move)
-                    # Add to Green (or check if green is full?)
-                    # For now, force Green.
-                    notes_by_color[DRUM_GREEN].append(note_to_move)
-
-             # Check Green Cymbals Collision
-            green_cymbals = [n for n in raw_notes if n in GREEN_CYMBALS]
-            if len(green_cymbals) > 1:
-                # 2+ Green Cymbals (Crash1 + China). Move one to Blue.
-                current_greens = notes_by_color[DRUM_GREEN]
-                if len(current_greens) > 1:
-                    note_to_move = max(current_greens)
-                    notes_by_color[DRUM_GREEN].remove(note_to_move)
-                    notes_by_color[DRUM_BLUE].append(note_to_move)
-
-
-            # --- Tom vs Cymbal Collision (Physical Impossibility) ---
-            # Now we iterate through the FINAL proposed colors to check Tom/Cymbal clashes
-            
-            # Flatten dict to list of (midi, assigned_gem)
-            final_assignments = []
-            for gem, notes in notes_by_color.items():
-                for n in notes:
-                    final_assignments.append((n, gem))
-            
-            green_tom_present = not raw_notes.isdisjoint(GREEN_TOMS)
-            blue_tom_present = not raw_notes.isdisjoint(BLUE_TOMS)
-            
-            start_gems = []
-            for midi_n, gem in final_assignments:
-                final_gem = gem
-                
-                # If we have a Cymbal on Green AND a Green Tom exists -> Move Cymbal to Blue
-                if gem == DRUM_GREEN and midi_n in GREEN_CYMBALS and green_tom_present:
-                     final_gem = DRUM_BLUE
-                
-                # If we have a Cymbal on Blue AND a Blue Tom exists -> Move Cymbal to Green
-                if gem == DRUM_BLUE and midi_n in BLUE_CYMBALS and blue_tom_present:
-                     final_gem = DRUM_GREEN
-                     
-                start_gems.append(final_gem)
-
-            # --- Final Unique Filter ---
-            # Prevent writing same gem twice (e.g. if logic moved everything to Green)
-            unique_gems = sorted(list(set(start_gems)))
-            
-            for g in unique_gems:
-                final_events.append((t, "note_on", g, 100))
-                final_events.append((t + NOTE_LEN, "note_off", g, 0))
-                
-            # Re-loop for markers based on raw
-            for midi_n in raw_notes:
-                 if midi_n in IS_TOM:
-                     # Check where this tom normally goes
-                     natural_gem = DRUM_MAPPING[midi_n]
-                     # If we outputted this gem, add marker
-                     if natural_gem in unique_gems:
-                         if natural_gem in TOM_MARKERS_MAP:
-                             marker = TOM_MARKERS_MAP[natural_gem]
-                             final_events.append((t, "note_on", marker, 100))
-                             final_events.append((t + NOTE_LEN, "note_off", marker, 0))
-
-        return sorted(final_events, key=lambda x: x[0])
-
-    def _reduce_difficulty(self, source_events: List[Tuple[int, str, int, int]], source_base: int, target_base: int, difficulty: str, tpb: int, instrument: str = "5lane") -> List[Tuple[int, str, int, int]]:
+        timeline = self._drum_hits(song, include_ghosts, kit, offset)
+        return timeline[np.argsort(timeline["tick"], kind="stable")]
+
+    def _resolve_conflicts(self, timeline: np.ndarray, kit: DrumKit) -> np.ndarray:
+        """
+        Converts timeline to events and resolves color collisions (see _resolve_chord).
+        Each distinct set of simultaneous hits is resolved once, then looked up by its note mask.
+        """
+        if not len(timeline):
+            return _note_events(np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.uint8), NOTE_LEN)
+
+        # 1. 128-bit note mask of every timestamp, as two 64-bit halves
+        times, starts = np.unique(timeline["tick"], return_index=True)
+        notes = timeline["note"].astype(np.uint64)
+        low = np.where(notes < 64, np.left_shift(np.uint64(1), notes % 64), np.uint64(0))
+        high = np.where(notes >= 64, np.left_shift(np.uint64(1), notes % 64), np.uint64(0))
+        masks = np.empty(len(times), dtype=[("high", np.uint64), ("low", np.uint64)])
+        masks["low"] = np.bitwise_or.reduceat(low, starts)
+        masks["high"] = np.bitwise_or.reduceat(high, starts)
+
+        # 2. Resolve each distinct hit set (a song has a few dozen)
+        chords, inverse = np.unique(masks, return_inverse=True)
+        resolved = [_resolve_chord(kit, int(c["high"]) << 64 | int(c["low"])) for c in chords]
+        sizes = np.array([len(r) for r in resolved], dtype=np.int64)
+        offsets = np.cumsum(sizes) - sizes
+        flat = np.array([n for r in resolved for n in r], dtype=np.uint8)
+
+        # 3. Expand back to every timestamp: the gems of its chord, in chord order
+        counts = sizes[inverse]
+        out_ticks = np.repeat(times, counts)
+        first = np.cumsum(counts) - counts
+        idx = np.arange(len(out_ticks)) - np.repeat(first - offsets[inverse], counts)
+        return _note_events(out_ticks, flat[idx], NOTE_LEN)
+
+    def _reduce_difficulty(self, source_events: np.ndarray, source_base: int, target_base: int, difficulty: str, tpb: int, instrument: str = "5lane") -> np.ndarray:
         """
         Generates a lower difficulty based on strict rules derived from the source events.
         """
-        reduced_events = []
-        
         # 1. Config based on difficulty
         # Grid snap: Minimum distance between note starts
         if difficulty == "Hard":
@@ -521,7 +929,7 @@ class MidiToYARGConverter:
              max_chord = 2 
              max_lane = 2 
         else:
-             return []
+             return np.zeros(0, dtype=EVENT_DTYPE)
 
         # Override for Drums specific logic
         if instrument == "drums":
@@ -534,268 +942,179 @@ class MidiToYARGConverter:
                  max_chord = 1 # Strict single note
                  # Lanes: 0=Kick, 1=Red(Snare), 2=Yellow(HiHat) 
 
-        # Group by start time
-        events_by_time = defaultdict(list)
-        for t, type_, note, vel in source_events:
-             if type_ == "note_on":
-                 events_by_time[t].append((note, vel))
-        
-        sorted_times = sorted(events_by_time.keys())
-        last_t = -min_step # Ensure first note is picked
+        # Note starts mapped to lanes, basic bounds check (drops markers and other diffs)
+        starts = source_events[source_events["kind"] == KIND_ON]
+        lanes = starts["note"].astype(np.int64) - source_base
+        in_bounds = (lanes >= 0) & (lanes <= 4)
+        ticks, lanes = self._select_lanes_for_difficulty(starts["tick"][in_bounds], lanes[in_bounds], instrument, difficulty, max_lane)
 
-        # Iterate through time steps
-        for t in sorted_times:
-             # Density Check
-             if t - last_t < min_step:
-                 continue
-             
-             # Update last_t immediately if we decide to emit
-             # But we first need to check if we have valid notes to emit
-             
-             original_notes = events_by_time[t]
-             mapped_notes = []
-             
-             for note, vel in original_notes:
-                 lane = note - source_base
-                 # Basic bounds check
-                 if 0 <= lane <= 4:
-                     mapped_notes.append(lane)
-             
-             if not mapped_notes:
-                 continue
+        if not len(ticks):
+            return np.zeros(0, dtype=EVENT_DTYPE)
 
-             valid_lanes = self._select_lanes_for_difficulty(mapped_notes, instrument, difficulty, max_lane)
-             
-             # Deduplicate and Cap Chord
-             unique_lanes = sorted(list(set(valid_lanes)))
-             
-             if len(unique_lanes) > max_chord:
-                  # Keep lowest/simplest notes
-                  unique_lanes = unique_lanes[:max_chord]
-             
-             # If we have content, write it and update last_t
-             if unique_lanes:
+        # Density Check: walk the distinct start times, keeping one every min_step
+        kept_times = []
+        last_t = -min_step # Ensure first note is picked
+        for t in np.unique(ticks).tolist():
+             if t - last_t >= min_step:
+                 kept_times.append(t)
                  last_t = t
-                 for lane in unique_lanes:
-                     final_note = target_base + lane
-                     reduced_events.append((t, "note_on", final_note, 100))
-                     reduced_events.append((t + NOTE_LEN, "note_off", final_note, 0))
-        
-        return sorted(reduced_events, key=lambda x: x[0])
+
+        keep = np.isin(ticks, kept_times)
+        ticks, lanes = ticks[keep], lanes[keep]
+
+        # Cap Chord: keep lowest/simplest notes
+        keep = _group_rank(ticks) < max_chord
+        return _note_events(ticks[keep], target_base + lanes[keep], NOTE_LEN)
 
 
-    def _select_lanes_for_difficulty(self, mapped_notes: List[int], instrument: str, difficulty: str, max_lane: int) -> List[int]:
+    def _select_lanes_for_difficulty(self, ticks: np.ndarray, lanes: np.ndarray, instrument: str, difficulty: str, max_lane: int) -> Tuple[np.ndarray, np.ndarray]:
         """
-        Applies instrument-specific reduction rules to a set of concurrent notes.
+        Applies instrument-specific reduction rules to the concurrent notes of each start time.
+        Returns unique (tick, lane) pairs sorted by tick, then lane.
         """
         if instrument == "drums":
             if difficulty == "Easy":
                 # Rule: Single Note Only. Priority: Snare(1) > Green(4) > Blue(3) > Kick(0) > Yellow(2)
-                priority_order = [1, 4, 3, 0, 2]
-                for p_lane in priority_order:
-                    if p_lane in mapped_notes:
-                        return [p_lane]
-                return []
-            else:
-                 # Hard/Medium: Keep original lanes (0-4), just restricted by density/chord cap later
-                 return mapped_notes
-
+                rank = _EASY_DRUM_RANK[lanes]
+                order = np.lexsort((rank, ticks))
+                ticks, lanes = ticks[order], lanes[order]
+                first = _group_rank(ticks) == 0
+                return ticks[first], lanes[first]
+            # Hard/Medium: Keep original lanes (0-4), just restricted by density/chord cap later
         else:
             # 5-Lane Guitar/Bass Shifting Logic
             # Shift notes down if they exceed max_lane (e.g. Orange -> Blue)
-            valid_lanes = []
-            for lane in mapped_notes:
-                if lane > max_lane:
-                    valid_lanes.append(max_lane)
-                else:
-                    valid_lanes.append(lane)
-            return valid_lanes
+            lanes = np.minimum(lanes, max_lane)
 
+        # Deduplicate (lanes fit in 3 bits)
+        pairs = np.unique(ticks * 8 + lanes)
+        return pairs // 8, pairs % 8
 
 
-    def _humanize_timeline(self, timeline: Dict[int, List[int]]) -> None:
+
+    def _humanize_timeline(self, timeline: np.ndarray, kit: DrumKit) -> np.ndarray:
         """
         Enforces 2-hand limit. Kicks are ignored (feet).
         Priority: Snare/Crash (3) > Tom/Ride (2) > Hi-Hat (1).
+        On a tie the second hand goes to a note whose gem the first one does not already
+        play (else the lower MIDI note), so no drum is lost to a duplicate gem.
+        Returns one hit per (time, note).
         """
-        for t, notes in timeline.items():
-            unique_notes = list(set(notes))
-            
-            # No optimization needed for feasible hits
-            if len(unique_notes) <= 2:
-                continue
-
-            hands = [n for n in unique_notes if n not in KICK_NOTES]
-            feet = [n for n in unique_notes if n in KICK_NOTES]
-
-            if len(hands) > 2:
-                # Sort descending: highest priority remains at index 0 and 1
-                hands.sort(key=lambda x: PRIORITY_MAP.get(x, 2), reverse=True)
-                
-                # Keep top 2 hands + all feet
-                timeline[t] = feet + hands[:2]
-
-    def _process_5lane(self, track: MidiTrack, quantize: bool, tpb: int, include_ghosts: bool, tempo_events: List[Tuple[int, MetaMessage]], offset: int = 0) -> List[Tuple[int, str, int, int]]:
+        if not len(timeline):
+            return timeline
+
+        # Unique notes per timestamp, sorted by time then note
+        _, first = np.unique(timeline["tick"] * 128 + timeline["note"], return_index=True)
+        timeline = timeline[first]
+
+        # No optimization needed for feasible hits (<= 2 notes at a timestamp)
+        _, group, counts = np.unique(timeline["tick"], return_inverse=True, return_counts=True)
+        crowded = (counts[group] > 2) & ~kit.is_kick[timeline["note"]]
+        if not crowded.any():
+            return timeline
+
+        # Sort hands descending by priority: the first hand is the highest priority
+        hands = np.flatnonzero(crowded)
+        notes = timeline["note"][hands]
+        order = np.lexsort((notes, -kit.priority[notes], group[hands]))
+        hands, notes, h_group = hands[order], notes[order], group[hands][order]
+        first = _group_rank(h_group) == 0
+
+        # Second hand: next highest priority, ties preferring a gem the first hand leaves free
+        first_gem = np.zeros(len(counts), dtype=kit.gem.dtype)
+        first_gem[h_group[first]] = kit.gem[notes[first]]
+        rest = np.flatnonzero(~first)
+        same_gem = kit.gem[notes[rest]] == first_gem[h_group[rest]]
+        rest = rest[np.lexsort((notes[rest], same_gem, -kit.priority[notes[rest]], h_group[rest]))]
+        second = rest[_group_rank(h_group[rest]) == 0]
+
+        # Keep top 2 hands + all feet
+        keep = np.ones(len(timeline), dtype=bool)
+        keep[hands] = False
+        keep[hands[first]] = True
+        keep[hands[second]] = True
+        return timeline[keep]
+
+    def _process_5lane(self, track: TrackEvents, quantizer: Optional[Quantizer], tpb: int, include_ghosts: bool, tempo_map: TempoMap, offset: int = 0) -> np.ndarray:
         """
         Processes 5-lane instrument notes (Guitar/Bass) with Dynamic Anchor Windows.
         Adapts to Time Signature changes to define 4-bar chunks accurately.
         """
-        # 1. Prepare Data: Filter valid notes
-        parsed_notes = []
-        active_notes = {} 
-        abs_t = offset
-        
+        # 1. Prepare Data: Filter valid notes (note/duration pairs are matched at ingest)
         vel_threshold = 1 if include_ghosts else MIN_VELOCITY
 
-        for msg in track:
-            abs_t += msg.time
-            if msg.type == "note_on" and msg.velocity > 0:
-                active_notes[msg.note] = (abs_t, msg.velocity)
-            elif (msg.type == "note_off") or (msg.type == "note_on" and msg.velocity == 0):
-                if msg.note in active_notes:
-                    start_t, velocity = active_notes.pop(msg.note)
-                    if velocity >= vel_threshold:
-                        duration = abs_t - start_t
-                        if duration > 0:
-                            parsed_notes.append((start_t, duration, msg.note))
-
-        if not parsed_notes:
-            return []
+        notes = track.notes[(track.notes["velocity"] >= vel_threshold) & (track.notes["duration"] > 0)]
+        if not len(notes):
+            return np.zeros(0, dtype=EVENT_DTYPE)
 
-        # 2. Build Dynamic Windows (4 Bars per window based on Time Signature)
-        # Sort TS events
-        ts_events = [x for x in tempo_events if x[1].type == "time_signature"]
-        ts_events.sort(key=lambda x: x[0])
-        
-        # Default 4/4 if no initial event
-        if not ts_events or ts_events[0][0] > 0:
-            ts_events.insert(0, (0, MetaMessage("time_signature", numerator=4, denominator=4)))
+        starts = notes["tick"] + offset
+        durations = notes["duration"].astype(np.int64)
+        pitches = notes["note"]
 
+        # 2. Build Dynamic Windows (4 Bars per window based on Time Signature)
         # Determine last note time to know when to stop
-        last_note_end = max(n[0] + n[1] for n in parsed_notes)
-        
-        windows = [] # [(start_tick, end_tick), ...]
-        curr_t = 0
-        ts_idx = 0
-        
-        # Generate windows covering the whole song duration
-        while curr_t < last_note_end:
-            # Check if we moved into a new TS zone
-            if ts_idx + 1 < len(ts_events) and curr_t >= ts_events[ts_idx + 1][0]:
-                ts_idx += 1
-                curr_t = ts_events[ts_idx][0] # Snap to TS change
-
-            msg = ts_events[ts_idx][1]
-            # Calculate tick length of 4 bars
-            # Ticks per Bar = tpb * (4 / denom) * numer
-            # Standard MIDI: tpb is ticks per quarter note
-            ticks_per_bar = int(tpb * 4 * msg.numerator / msg.denominator)
-            window_len = ticks_per_bar * 4
-            
-            # Add windows until we hit next event or end
-            next_event_t = ts_events[ts_idx + 1][0] if ts_idx + 1 < len(ts_events) else float('inf')
-            
-            while curr_t < next_event_t and curr_t < last_note_end:
-                 effective_end = min(curr_t + window_len, next_event_t)
-                 
-                 if effective_end > curr_t:
-                     windows.append((curr_t, effective_end))
-                     curr_t += window_len
-                 else:
-                     curr_t = next_event_t
-
-        # 3. Assign notes to windows
-        windowed_notes = defaultdict(list)
-        
-        for p_note in parsed_notes:
-            t_start = p_note[0]
-            for i, (w_start, w_end) in enumerate(windows):
-                if w_start <= t_start < w_end:
-                    windowed_notes[i].append(p_note)
-                    break
-        
-        # 4. Process
-        anchor_grid = tpb / 2
-        tolerance_ticks = tpb * 0.11
-        events_buffer = []
+        last_note_end = int((starts + durations).max())
+        windows = tempo_map.bar_windows(last_note_end, bars=4)
 
-        for w_idx in sorted(windowed_notes.keys()):
-            notes_in_window = windowed_notes[w_idx]
-            
-            pitches = [n for _, _, n in notes_in_window]
-            unique_pitches = sorted(list(set(pitches)))
-            local_pitch_map = {note: i for i, note in enumerate(unique_pitches)}
-            
-            # Pre-calculate unique timestamps to find gaps between musical events/chords
-            sorted_notes = sorted(notes_in_window, key=lambda x: x[0])
-
-            for i, (t, dur, note) in enumerate(sorted_notes):
-                final_time = t
-                if quantize:
-                    nearest = round(t / anchor_grid) * anchor_grid
-                    if abs(t - nearest) <= tolerance_ticks:
-                        final_time = int(nearest)
-
-                rank = local_pitch_map[note]
-                gem_offset = rank % 5
-                gem = GEM_GREEN + gem_offset
-                
-                # --- Sustain Logic (Time-Based) ---
-                # Fixed Visual Gap
-                gap_ticks = 30  
-                
-                # Find current tempo (microseconds per beat) to convert ticks to ms
-                current_mpqn = 500000 # Default 120 BPM
-                for ev_t, ev_msg in tempo_events:
-                    if ev_t > t:
-                        break
-                    if ev_msg.type == 'set_tempo':
-                        current_mpqn = ev_msg.tempo
-                
-                # Convert duration to milliseconds
-                # Formula: (ticks / tpb) * (microseconds_per_beat / 1000)
-                dur_ms = (dur / tpb) * (current_mpqn / 1000.0)
-                
-                # Threshold for a "playable" sustain (approx 170-200ms)
-                MIN_SUSTAIN_MS = 200.0 
-                
-                # Check 1: Is the note long enough?
-                is_long_enough = dur_ms >= MIN_SUSTAIN_MS
-                
-                # Check 2: Space availability
-                # We do NOT allow "sustained arpeggios". If another note starts while this one 
-                # is holding (and it's not a chord), we cut the sustain.
-                has_space = True
-                if is_long_enough:
-                     effective_end = t + dur - gap_ticks
-                     # Look ahead
-                     for j in range(i + 1, len(sorted_notes)):
-                         next_start, _, _ = sorted_notes[j]
-                         
-                         # If next note starts after ours but strictly inside our window -> Overlap
-                         if next_start > t and next_start < effective_end:
-                             has_space = False
-                             break
-                         
-                         if next_start >= effective_end:
-                             break
-
-                is_sustain = is_long_enough and has_space
-
-                if is_sustain:
-                    final_dur = max(NOTE_LEN, dur - gap_ticks)
-                else:
-                    final_dur = NOTE_LEN
-
-                events_buffer.append((final_time, "note_on", gem, 100))
-                events_buffer.append((final_time + final_dur, "note_off", gem, 0))
-
-        return sorted(events_buffer, key=lambda x: x[0])
+        # 3. Assign notes to windows: bisect the sorted window starts (O(n log w))
+        w_starts = np.array([w[0] for w in windows], dtype=np.int64)
+        w_ends = np.array([w[1] for w in windows], dtype=np.int64)
 
-    def _write_track(self, track: MidiTrack, events: List[Tuple[int, str, int, int]]) -> None:
-        last_t = 0
-        for abs_t, type_, note, vel in events:
-            # Calculate delta time relative to the previous event
-            delta = max(0, abs_t - last_t)
-            track.append(Message(type_, note=note, velocity=vel, time=delta, channel=0))
-            last_t = abs_t
\ No newline at end of file
+        window_of = np.searchsorted(w_starts, starts, side="right") - 1
+        outside = (window_of < 0) | (starts >= w_ends[np.maximum(window_of, 0)])
+        window_of[outside] = -1
+        
+        # 4. Process
+        final_times = quantizer.snap(starts) if quantizer else starts
+
+        gems = np.zeros(len(notes), dtype=np.int64)
+        final_durs = np.full(len(notes), NOTE_LEN, dtype=np.int64)
+
+        # Notes grouped by window, time-sorted inside each window
+        order = np.lexsort((starts, window_of))
+        order = order[window_of[order] >= 0]
+        if not len(order):
+            return np.zeros(0, dtype=EVENT_DTYPE)
+        o_window = window_of[order]
+        o_starts = starts[order]
+
+        # Local pitch ranking inside the window -> Gem (Green..Orange, wrapping)
+        pairs, pair_of = np.unique(o_window * 128 + pitches[order], return_inverse=True)
+        pair_window = pairs // 128
+        rank = np.arange(len(pairs)) - np.searchsorted(pair_window, pair_window, side="left")
+        gems[order] = GEM_GREEN + rank[pair_of] % 5
+
+        # --- Sustain Logic (Time-Based) ---
+        # Fixed Visual Gap
+        gap_ticks = 30
+
+        # Threshold for a "playable" sustain (approx 170-200ms)
+        MIN_SUSTAIN_MS = 200.0
+
+        # Check 1: Is the note long enough?
+        # Formula: (ticks / tpb) * (microseconds_per_beat / 1000), at the tempo where the note starts
+        o_durs = durations[order]
+        dur_ms = (o_durs / tpb) * (tempo_map.tempos_at(o_starts) / 1000.0)
+        is_long_enough = dur_ms >= MIN_SUSTAIN_MS
+
+        # Check 2: Space availability
+        # We do NOT allow "sustained arpeggios". If another note starts while this one
+        # is holding (and it's not a chord), we cut the sustain.
+        # Next distinct onset of every note: the first tick of the next chord in its window
+        chord_start = np.ones(len(order), dtype=bool)
+        chord_start[1:] = (o_starts[1:] != o_starts[:-1]) | (o_window[1:] != o_window[:-1])
+        chord_of = np.cumsum(chord_start) - 1
+        chord_ticks = np.append(o_starts[chord_start], np.iinfo(np.int64).max)
+        chord_window = np.append(o_window[chord_start], -1)
+        next_onset = np.where(chord_window[chord_of + 1] == o_window, chord_ticks[chord_of + 1], np.iinfo(np.int64).max)
+        has_space = next_onset >= o_starts + o_durs - gap_ticks
+
+        sustained = is_long_enough & has_space
+        final_durs[order[sustained]] = np.maximum(NOTE_LEN, o_durs[sustained] - gap_ticks)
+
+        placed = window_of >= 0
+        return _note_events(final_times[placed], gems[placed], final_durs[placed])
+
+    def _write_track(self, track: TrackWriter, events: np.ndarray) -> None:
+        # Encoded straight from the sorted arrays, no per-event Message objects
+        track.notes(events["tick"], events["kind"], events["note"], events["velocity"])
@@ -0,0 +1,116 @@
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from ingest import TrackSummary
+from mappings import PROG_BASS_MAX, PROG_BASS_MIN, PROG_GUITAR_MAX, PROG_GUITAR_MIN
+
+
+# Per instrument: name keywords, GM program range, typical pitch range and chord ratio
+PROFILES = {
+    "bass": {
+        "keywords": ("bass",),
+        "programs": (PROG_BASS_MIN, PROG_BASS_MAX),
+        "pitch": (28, 55),
+        "chords": 0.05,
+    },
+    "guitar": {
+        "keywords": ("guitar", "gtr"),
+        "programs": (PROG_GUITAR_MIN, PROG_GUITAR_MAX),
+        "pitch": (40, 84),
+        "chords": 0.35,
+    },
+}
+
+# Feature weights (sum to 1): the confidence of a candidate is its weighted score
+WEIGHTS = {"name": 0.35, "program": 0.30, "pitch": 0.15, "chords": 0.10, "activity": 0.10}
+
+# A track is only a candidate when its name holds the instrument (first keyword) or it
+# uses one of its programs, like the old first-match lookup; the other features just rank
+# those tracks, so a piano with a guitar-like range is never picked
+
+# Below this confidence a track is not picked at all
+MIN_CONFIDENCE = 0.3
+
+# Picked in this order so one track never ends up in two parts
+DETECT_ORDER = ("bass", "guitar")
+
+
+@dataclass(frozen=True)
+class Candidate:
+    """
+    A source track ranked for an instrument. confidence is in [0, 1].
+    """
+    index: int
+    name: str
+    confidence: float
+    features: Dict[str, float]
+
+
+def rank_tracks(summaries: Sequence[TrackSummary], instrument: str) -> List[Candidate]:
+    """
+    Melodic tracks named or programmed as `instrument` ("bass" or "guitar"), ordered by
+    how likely they are to be it. Ties keep track order.
+    """
+    profile = PROFILES[instrument]
+    busiest = max((_density(s) for s in summaries), default=0.0) or 1.0
+
+    candidates = []
+    for s in summaries:
+        if not s.melodic_count:
+            continue # Conductor, empty and drum-only tracks
+        features = {
+            "name": _name_score(s, profile["keywords"], instrument),
+            "program": _program_score(s, profile["programs"]),
+            "pitch": _range_score(s.pitch_mean, profile["pitch"]),
+            "chords": max(0.0, 1.0 - abs(s.chord_ratio - profile["chords"]) * 2),
+            "activity": _density(s) / busiest,
+        }
+        if features["name"] < 1.0 and not features["program"]:
+            continue
+        confidence = sum(WEIGHTS[k] * v for k, v in features.items())
+        candidates.append(Candidate(s.index, s.name, round(confidence, 3), features))
+
+    candidates.sort(key=lambda c: -c.confidence)
+    return candidates
+
+
+def detect_instruments(summaries: Sequence[TrackSummary]) -> Dict[str, Optional[Candidate]]:
+    """
+    Best distinct track for each instrument, or None when nothing reaches MIN_CONFIDENCE.
+    """
+    picked = {}
+    used = set()
+    for instrument in DETECT_ORDER:
+        best = next((c for c in rank_tracks(summaries, instrument)
+                     if c.index not in used and c.confidence >= MIN_CONFIDENCE), None)
+        picked[instrument] = best
+        if best:
+            used.add(best.index)
+    return picked
+
+
+def _name_score(s: TrackSummary, keywords: Tuple[str, ...], instrument: str) -> float:
+    names = " ".join(s.names).lower()
+    if instrument != "bass" and "bass" in names:
+        return 0.0 # "Bass Guitar" is a bass
+    if keywords[0] in names:
+        return 1.0
+    return 0.6 if any(k in names for k in keywords[1:]) else 0.0
+
+
+def _program_score(s: TrackSummary, prog_range: Tuple[int, int]) -> float:
+    if not s.programs:
+        return 0.0
+    low, high = prog_range
+    return sum(low <= p <= high for p in s.programs) / len(s.programs)
+
+
+def _range_score(value: float, bounds: Tuple[int, int]) -> float:
+    # 1 inside the range, fading to 0 one octave outside of it
+    low, high = bounds
+    distance = max(low - value, value - high, 0)
+    return max(0.0, 1.0 - distance / 12)
+
+
+def _density(s: TrackSummary) -> float:
+    return s.melodic_count / max(s.span_ticks, 1)
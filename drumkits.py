@@ -0,0 +1,112 @@
+import hashlib
+import json
+import os
+from functools import lru_cache
+from typing import Dict, List
+
+import numpy as np
+
+from mappings import DRUM_BLUE, DRUM_GREEN, DRUM_KICK, DRUM_SNARE, DRUM_YELLOW, TOM_MARKERS_MAP
+
+
+KITS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "kits")
+DEFAULT_KIT = "gm"
+
+# Note classes
+CLASS_NONE = 0 # Not part of the kit: ignored
+CLASS_KICK = 1
+CLASS_SNARE = 2
+CLASS_TOM = 3
+CLASS_CYMBAL = 4
+CLASS_SPLASH = 5 # Yellow cymbal that moves to Green when another Yellow is hit with it
+
+# Kit file roles -> (class, gem)
+ROLES = {
+    "kick": (CLASS_KICK, DRUM_KICK),
+    "snare": (CLASS_SNARE, DRUM_SNARE),
+    "tom_yellow": (CLASS_TOM, DRUM_YELLOW),
+    "tom_blue": (CLASS_TOM, DRUM_BLUE),
+    "tom_green": (CLASS_TOM, DRUM_GREEN),
+    "cymbal_yellow": (CLASS_CYMBAL, DRUM_YELLOW),
+    "cymbal_blue": (CLASS_CYMBAL, DRUM_BLUE),
+    "cymbal_green": (CLASS_CYMBAL, DRUM_GREEN),
+    "splash": (CLASS_SPLASH, DRUM_YELLOW),
+}
+
+DEFAULT_PRIORITY = 2 # Humanization priority of notes not listed in the kit file (higher = keep)
+
+
+class DrumKit:
+    """
+    A drum note layout compiled into 128-entry lookup arrays indexed by MIDI note:
+    gem (expert drum note, 0 = unmapped), note class, humanization priority and tom marker.
+
+    Kit files (kits/<name>.json) list the MIDI notes of each role (see ROLES) and the
+    notes whose priority differs from DEFAULT_PRIORITY:
+        {"name": "General MIDI", "notes": {"kick": [35, 36], ...}, "priority": {"3": [38], "1": [42]}}
+    """
+
+    def __init__(self, name: str, notes: Dict[str, List[int]], priority: Dict[str, List[int]]):
+        self.name = name
+        # Identifies the layout: caches of charts and drum chords are keyed on it, not on the kit name
+        layout = json.dumps([notes, priority], sort_keys=True).encode("utf-8")
+        self.digest = hashlib.sha256(layout).hexdigest()[:16]
+        self.gem = np.zeros(128, dtype=np.uint8)
+        self.note_class = np.zeros(128, dtype=np.uint8)
+        self.priority = np.full(128, DEFAULT_PRIORITY, dtype=np.int64)
+        self.marker = np.zeros(128, dtype=np.uint8)
+
+        for role, midi_notes in notes.items():
+            if role not in ROLES:
+                raise ValueError(f"Unknown drum role in kit '{name}': {role} (expected {', '.join(ROLES)})")
+            note_class, gem = ROLES[role]
+            self.gem[midi_notes] = gem
+            self.note_class[midi_notes] = note_class
+            if note_class == CLASS_TOM:
+                self.marker[midi_notes] = TOM_MARKERS_MAP[gem]
+        for value, midi_notes in priority.items():
+            self.priority[midi_notes] = int(value)
+
+        self.mapped = self.gem > 0
+        self.is_kick = self.note_class == CLASS_KICK
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, DrumKit) and self.digest == other.digest
+
+    def __hash__(self) -> int:
+        return hash(self.digest)
+
+    def __repr__(self) -> str:
+        return f"DrumKit({self.name!r})"
+
+
+def kit_names() -> List[str]:
+    """
+    Kits shipped in KITS_DIR, by file name without .json.
+    """
+    return sorted(f[:-5] for f in os.listdir(KITS_DIR) if f.endswith(".json"))
+
+
+def load_kit(kit: str = DEFAULT_KIT) -> DrumKit:
+    """
+    Loads a kit by name (a file in KITS_DIR) or by path to a .json kit file.
+    Kits are compiled once per process and again whenever their file changes.
+    """
+    path = kit if kit.lower().endswith(".json") else os.path.join(KITS_DIR, f"{kit}.json")
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        raise ValueError(f"Unknown drum kit: {kit} (expected {', '.join(kit_names())} or a .json file)")
+    return _compile_kit(kit, path, stat.st_mtime_ns, stat.st_size)
+
+
+@lru_cache(maxsize=32)
+def _compile_kit(kit: str, path: str, mtime_ns: int, size: int) -> DrumKit:
+    # mtime_ns and size are only part of the cache key
+    with open(path, encoding="utf-8") as fh:
+        data = json.load(fh)
+    for midi_notes in list(data["notes"].values()) + list(data.get("priority", {}).values()):
+        bad = [n for n in midi_notes if not isinstance(n, int) or not 0 <= n <= 127]
+        if bad:
+            raise ValueError(f"Invalid MIDI note in drum kit {path}: {bad[0]!r} (expected 0-127)")
+    return DrumKit(data.get("name", kit), data["notes"], data.get("priority", {}))
@@ -0,0 +1,257 @@
+import os
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+from mido import MetaMessage
+
+from smf import META_SET_TEMPO, META_TIME_SIGNATURE, META_TRACK_NAME, iter_events, iter_track_chunks, read_header
+
+
+# One row per note_on: ~15 bytes instead of a tuple of Python ints
+NOTE_DTYPE = np.dtype([
+    ("tick", np.int64),
+    ("duration", np.int32),
+    ("note", np.uint8),
+    ("velocity", np.uint8),
+    ("channel", np.uint8),
+])
+
+
+@dataclass
+class TrackEvents:
+    """
+    Everything the converter needs from one source track, in absolute ticks.
+    Notes are a NOTE_DTYPE array in note_on order.
+    A note_on that is never released keeps duration 0.
+    """
+    index: int
+    names: List[str] = field(default_factory=list)
+    programs: List[int] = field(default_factory=list)
+    channels: Set[int] = field(default_factory=set)
+    notes: np.ndarray = field(default_factory=lambda: np.zeros(0, dtype=NOTE_DTYPE))
+    end_tick: int = 0
+
+    @property
+    def name(self) -> str:
+        return self.names[0] if self.names else "Untitled Track"
+
+
+@dataclass
+class SongEvents:
+    """
+    Absolute-time event table of a whole MIDI file, built in a single pass.
+    tempo_events holds the set_tempo/time_signature messages of track 0.
+    """
+    ticks_per_beat: int
+    tracks: List[TrackEvents]
+    tempo_events: List[Tuple[int, MetaMessage]]
+
+    def channel_notes(self, channel: int) -> np.ndarray:
+        """
+        All notes played on a channel, across every track, in track order.
+        """
+        parts = [t.notes[t.notes["channel"] == channel] for t in self.tracks]
+        if not parts:
+            return np.zeros(0, dtype=NOTE_DTYPE)
+        return np.concatenate(parts)
+
+    @property
+    def total_ticks(self) -> int:
+        return max((t.end_tick for t in self.tracks), default=0)
+
+
+def merge_tracks(tracks: Sequence[TrackEvents]) -> TrackEvents:
+    """
+    Combines several source tracks into one (e.g. two guitar tracks for a single part).
+    Notes are ordered by tick; on equal ticks earlier tracks come first.
+    A single track is returned as is.
+    """
+    if len(tracks) == 1:
+        return tracks[0]
+
+    notes = np.concatenate([t.notes for t in tracks])
+    merged = TrackEvents(index=tracks[0].index)
+    merged.names = [name for t in tracks for name in t.names]
+    merged.programs = [p for t in tracks for p in t.programs]
+    merged.channels = set().union(*(t.channels for t in tracks))
+    merged.notes = notes[np.argsort(notes["tick"], kind="stable")]
+    merged.end_tick = max(t.end_tick for t in tracks)
+    return merged
+
+
+def parse_song(data: bytes) -> SongEvents:
+    """
+    Parses MIDI file bytes once, matching note_on/note_off pairs per (channel, note).
+    Reads the raw chunk bytes: only notes, track names, program changes and the tempo
+    events of track 0 are decoded, controllers, pitch bends and sysex are skipped by length.
+    """
+    _, tpb, pos = read_header(data)
+
+    tracks = []
+    tempo_events = []
+    try:
+        for i, (start, end) in enumerate(iter_track_chunks(data, pos)):
+            tracks.append(_read_track(data, start, end, i, tempo_events if i == 0 else None))
+    except IndexError:
+        raise ValueError("Truncated MIDI file") from None
+
+    return SongEvents(tpb, tracks, tempo_events)
+
+
+def _read_track(data: bytes, pos: int, end: int, index: int,
+                tempo_events: Optional[List[Tuple[int, MetaMessage]]]) -> TrackEvents:
+    """
+    TrackEvents of one MTrk chunk body. set_tempo/time_signature events are appended
+    to tempo_events when given (track 0).
+    """
+    track = TrackEvents(index=index)
+    ticks, durations, pitches, velocities, channels = [], [], [], [], []
+    active = {} # (channel, note) -> index of the sounding note_on
+    tick = 0
+
+    for tick, delta, status, data1, data2, payload in iter_events(data, pos, end):
+        high = status & 0xF0
+        if high == 0x90 or high == 0x80:
+            channel = status & 0x0F
+            if high == 0x90 and data2:
+                active[(channel, data1)] = len(ticks)
+                ticks.append(tick)
+                durations.append(0)
+                pitches.append(data1)
+                velocities.append(data2)
+                channels.append(channel)
+            else:
+                idx = active.pop((channel, data1), None)
+                if idx is not None:
+                    durations[idx] = tick - ticks[idx]
+        elif high == 0xC0:
+            track.programs.append(data1)
+        elif status == 0xFF:
+            if data1 == META_TRACK_NAME:
+                track.names.append(payload.decode("latin-1"))
+            elif tempo_events is not None and data1 == META_SET_TEMPO and len(payload) >= 3:
+                tempo = int.from_bytes(payload[:3], "big")
+                tempo_events.append((tick, MetaMessage("set_tempo", tempo=tempo, time=delta)))
+            elif tempo_events is not None and data1 == META_TIME_SIGNATURE and len(payload) >= 4:
+                numerator, exponent, clocks, notated = payload[:4]
+                tempo_events.append((tick, MetaMessage(
+                    "time_signature", numerator=numerator, denominator=2 ** exponent,
+                    clocks_per_click=clocks, notated_32nd_notes_per_beat=notated, time=delta)))
+
+    notes = np.zeros(len(ticks), dtype=NOTE_DTYPE)
+    notes["tick"] = ticks
+    notes["duration"] = durations
+    notes["note"] = pitches
+    notes["velocity"] = velocities
+    notes["channel"] = channels
+    track.notes = notes
+    track.channels = set(channels)
+    track.end_tick = tick
+    return track
+
+
+@dataclass(frozen=True)
+class TrackSummary:
+    """
+    What the track picker and instrument detection need to know about a track, without its events.
+    Pitch, chord and span statistics only cover melodic notes (not channel 10).
+    """
+    index: int
+    names: Tuple[str, ...]
+    programs: Tuple[int, ...]
+    channels: Tuple[int, ...]
+    note_count: int
+    melodic_count: int = 0
+    pitch_min: int = 0
+    pitch_max: int = 0
+    pitch_mean: float = 0.0
+    chord_ratio: float = 0.0 # Share of melodic notes starting together with the previous one
+    span_ticks: int = 0      # First to last melodic note start
+
+    @property
+    def name(self) -> str:
+        return self.names[0] if self.names else "Untitled Track"
+
+
+def summarize_track(track: TrackEvents) -> TrackSummary:
+    """
+    TrackSummary of an already ingested track (same statistics as scan_song).
+    """
+    notes = track.notes
+    melodic = notes[notes["channel"] != 9]
+    stats = {}
+    if len(melodic):
+        ticks = melodic["tick"]
+        pitches = melodic["note"].astype(np.int64)
+        stats = dict(
+            melodic_count=len(melodic),
+            pitch_min=int(pitches.min()),
+            pitch_max=int(pitches.max()),
+            pitch_mean=float(pitches.mean()),
+            chord_ratio=float(np.count_nonzero(ticks[1:] == ticks[:-1]) / len(melodic)),
+            span_ticks=int(ticks[-1] - ticks[0]),
+        )
+    channels = tuple(sorted(int(c) for c in np.unique(notes["channel"])))
+    return TrackSummary(track.index, tuple(track.names), tuple(track.programs), channels, len(notes), **stats)
+
+
+def scan_song(midi_path: str) -> Tuple[TrackSummary, ...]:
+    """
+    Track index of a MIDI file: names, programs, channels, note counts and pitch statistics per track.
+    Walks the raw chunk bytes without building any message, and is cached per
+    (path, mtime, size), so rescanning an unchanged file is free.
+    """
+    stat = os.stat(midi_path)
+    return _scan_cached(os.path.abspath(midi_path), stat.st_mtime_ns, stat.st_size)
+
+
+@lru_cache(maxsize=32)
+def _scan_cached(path: str, mtime_ns: int, size: int) -> Tuple[TrackSummary, ...]:
+    with open(path, "rb") as fh:
+        data = fh.read()
+    _, _, pos = read_header(data)
+    return tuple(_scan_track(data, start, end, i) for i, (start, end) in enumerate(iter_track_chunks(data, pos)))
+
+
+def _scan_track(data: bytes, pos: int, end: int, index: int) -> TrackSummary:
+    names = []
+    programs = []
+    channels = set()
+    notes = 0
+
+    # Melodic note statistics
+    melodic = 0
+    pitch_min, pitch_max, pitch_sum = 127, 0, 0
+    chords = 0
+    first_tick = last_tick = -1
+
+    for tick, _, status, data1, data2, payload in iter_events(data, pos, end):
+        high = status & 0xF0
+        if high == 0x90:
+            if data2:
+                notes += 1
+                channel = status & 0x0F
+                channels.add(channel)
+                if channel != 9:
+                    melodic += 1
+                    pitch_sum += data1
+                    if data1 < pitch_min:
+                        pitch_min = data1
+                    if data1 > pitch_max:
+                        pitch_max = data1
+                    if tick == last_tick:
+                        chords += 1
+                    if first_tick < 0:
+                        first_tick = tick
+                    last_tick = tick
+        elif high == 0xC0:
+            programs.append(data1)
+        elif status == 0xFF and data1 == META_TRACK_NAME:
+            names.append(payload.decode("latin-1"))
+
+    if not melodic:
+        return TrackSummary(index, tuple(names), tuple(programs), tuple(sorted(channels)), notes)
+    return TrackSummary(index, tuple(names), tuple(programs), tuple(sorted(channels)), notes,
+                        melodic, pitch_min, pitch_max, pitch_sum / melodic, chords / melodic, last_tick - first_tick)
@@ -1,10 +1,14 @@
+import multiprocessing
 import os
+import queue
+import threading
 import webbrowser
 from tkinter import filedialog, messagebox
 
 import customtkinter as ctk
 
-from converter import MidiToYARGConverter
+from converter import ConversionCancelled, MidiToYARGConverter, band_difficulty, metadata_from_filename
+from drumkits import DEFAULT_KIT, kit_names, load_kit
 
 
 # Configuration
@@ -12,6 +16,14 @@ VERSION = "1.2.1"
 THEME_MODE = "Dark"
 THEME_COLOR = "blue"
 
+# Quantize grid presets (coarse to fine, see quantize.GRIDS)
+GRID_PRESETS = {
+    "1/8": ("1/8",),
+    "1/8 + 1/16": ("1/8", "1/16"),
+    "1/8 + Triplets": ("1/8", "1/8T"),
+    "All Grids": ("1/8", "1/8T", "1/16", "1/16T"),
+}
+
 
 class CTkToolTip(ctk.CTkToplevel):
     def __init__(self, widget, text, url=None):
@@ -72,7 +84,11 @@ class CTkToolTip(ctk.CTkToplevel):
 class App(ctk.CTk):
     def __init__(self):
         super().__init__()
-        self.converter = MidiToYARGConverter()
+        # One song at a time: build its instruments side by side on all cores
+        self.converter = MidiToYARGConverter(workers=os.cpu_count() or 1)
+        # Worker thread -> UI messages, drained by _poll_worker on the Tk thread
+        self._worker_queue = queue.Queue()
+        self._cancel_event = threading.Event()
         self._setup_window()
         self._init_ui()
 
@@ -82,7 +98,7 @@ class App(ctk.CTk):
         ctk.set_default_color_theme(THEME_COLOR)
         
         self.title(f"Midi to YARG Converter {VERSION}")
-        self.geometry("800x750")
+        self.geometry("800x800")
         self.resizable(False, False)
         
         self.midi_path = ""
@@ -199,7 +215,12 @@ class App(ctk.CTk):
 
         # -- Drums Row --
         ctk.CTkLabel(matrix_frame, text="Drums:", anchor="w").grid(row=1, column=0, padx=5, pady=5, sticky="w")
-        ctk.CTkLabel(matrix_frame, text="Auto (Channel 10)", text_color="gray").grid(row=1, column=1, padx=5, pady=5, sticky="w")
+        # Channel 10 notes, read with the note layout of the kit that exported them
+        self.drum_kits = {load_kit(name).name: name for name in kit_names()}
+        self.kit_var = ctk.StringVar(value=load_kit(DEFAULT_KIT).name)
+        cbo_kit = ctk.CTkOptionMenu(matrix_frame, values=list(self.drum_kits), variable=self.kit_var, width=140)
+        cbo_kit.grid(row=1, column=1, padx=5, pady=5)
+        CTkToolTip(cbo_kit, text="Drum kit the MIDI was exported from.\nPick General MIDI unless it comes from a drum plugin.")
         
         self.diff_vars['drums'] = ctk.StringVar(value="6") # Default Expert
         ctk.CTkOptionMenu(matrix_frame, values=diff_values, variable=self.diff_vars['drums'], width=110).grid(row=1, column=2, padx=5, pady=5)
@@ -224,6 +245,10 @@ class App(ctk.CTk):
         inst_label = ctk.CTkLabel(matrix_frame, text="Note: Set to 'Disabled' to turn off an instrument.", text_color="gray", font=("Arial", 10))
         inst_label.grid(row=4, column=0, columnspan=3, pady=(5, 0), sticky="w")
 
+        # What Auto-Detect picked, with its confidence
+        self.lbl_detect = ctk.CTkLabel(matrix_frame, text="", text_color="gray", font=("Arial", 10))
+        self.lbl_detect.grid(row=5, column=0, columnspan=3, sticky="w")
+
 
         # --- BOTTOM SECTION: Options ---
         opts_frame = ctk.CTkFrame(self, fg_color="transparent")
@@ -246,6 +271,12 @@ class App(ctk.CTk):
         moonscraper_url = "https://github.com/FireFox2000000/Moonscraper-Chart-Editor"
         CTkToolTip(sw_quant, text=tooltip_text, url=moonscraper_url)
 
+        # Quantize grid (picked per measure when several are allowed)
+        self.grid_var = ctk.StringVar(value="1/8")
+        cbo_grid = ctk.CTkOptionMenu(sw_container, values=list(GRID_PRESETS), variable=self.grid_var, width=130)
+        cbo_grid.pack(side="left", padx=(0, 20))
+        CTkToolTip(cbo_grid, text="Quantize grid.\nWith several grids, each measure uses the one that fits best.")
+
         # Ghosts
         self.ghosts_var = ctk.BooleanVar(value=False)
         sw_ghost = ctk.CTkSwitch(sw_container, text="Include Ghost Notes", variable=self.ghosts_var, onvalue=True, offvalue=False)
@@ -268,7 +299,21 @@ class App(ctk.CTk):
         self.btn_run = ctk.CTkButton(self, text="GENERATE CHART", height=50, 
                                      fg_color="#1f538d", font=("Arial", 16, "bold"), 
                                      command=self._process_chart)
-        self.btn_run.pack(pady=20, padx=20, fill="x")
+        self.btn_run.pack(pady=(20, 10), padx=20, fill="x")
+
+        frame = ctk.CTkFrame(self, fg_color="transparent")
+        frame.pack(padx=20, fill="x")
+
+        self.progress_bar = ctk.CTkProgressBar(frame)
+        self.progress_bar.set(0)
+        self.progress_bar.pack(side="left", fill="x", expand=True, padx=(0, 10))
+
+        self.lbl_stage = ctk.CTkLabel(frame, text="Idle", width=120, anchor="w", text_color="gray")
+        self.lbl_stage.pack(side="left", padx=(0, 10))
+
+        self.btn_cancel = ctk.CTkButton(frame, text="Cancel", width=80, fg_color="#8d1f1f",
+                                        state="disabled", command=self._cancel_chart)
+        self.btn_cancel.pack(side="left")
 
     def _create_footer(self):
         # Footer simplified since instructions are clearer now
@@ -292,8 +337,19 @@ class App(ctk.CTk):
             
             self.cbo_guitar.configure(values=options)
             self.cbo_bass.configure(values=options)
-            self.cbo_guitar.set("None")
-            self.cbo_bass.set("None")
+
+            # Preselect the detected tracks, so switching Auto-Detect off starts from its choice
+            detected = self.converter.detect_tracks(path)
+            summary = []
+            for inst, cbo in (("guitar", self.cbo_guitar), ("bass", self.cbo_bass)):
+                cand = detected.get(inst)
+                if cand:
+                    cbo.set(f"{cand.index}: {cand.name}")
+                    summary.append(f"{inst.capitalize()}: {cand.name} ({cand.confidence:.0%})")
+                else:
+                    cbo.set("None")
+                    summary.append(f"{inst.capitalize()}: not found")
+            self.lbl_detect.configure(text="Auto-Detect: " + ", ".join(summary))
 
     def _select_audio_file(self):
         path = filedialog.askopenfilename(filetypes=[("OGG Files", "*.ogg"), ("All Files", "*.*")])
@@ -313,7 +369,6 @@ class App(ctk.CTk):
 
     def _fill_metadata_from_filename(self, filename):
         """Auto-populate Artist and Song fields based on filename pattern 'Artist - Song'."""
-        base = os.path.splitext(filename)[0]
         artist_entry = self.form_entries['artist']
         song_entry = self.form_entries['song']
         
@@ -321,13 +376,9 @@ class App(ctk.CTk):
         artist_entry.delete(0, "end")
         song_entry.delete(0, "end")
 
-        if "-" in base:
-            parts = base.split("-", 1)
-            artist_entry.insert(0, parts[0].strip())
-            song_entry.insert(0, parts[1].strip())
-        else:
-            artist_entry.insert(0, "Unknown Artist")
-            song_entry.insert(0, base)
+        guessed = metadata_from_filename(filename)
+        artist_entry.insert(0, guessed["artist"])
+        song_entry.insert(0, guessed["name"])
 
     def _get_form_data(self):
         data = {key: entry.get() for key, entry in self.form_entries.items()}
@@ -352,19 +403,8 @@ class App(ctk.CTk):
         data['diff_bass'] = str(d_bass)
 
         # Calculate Band Difficulty (Average of active instruments)
-        # Instrument is active if difficulty >= 0
-        active_diffs = []
-        if d_drums >= 0: active_diffs.append(d_drums)
-        if d_guitar >= 0: active_diffs.append(d_guitar)
-        if d_bass >= 0: active_diffs.append(d_bass)
-        
-        if active_diffs:
-            avg = sum(active_diffs) / len(active_diffs)
-            data['diff_band'] = str(round(avg))
-        else:
-            # If all are disabled
-            data['diff_band'] = "-1"
-            
+        data['diff_band'] = band_difficulty([d_drums, d_guitar, d_bass])
+
         return data
 
     def _process_chart(self):
@@ -400,44 +440,101 @@ class App(ctk.CTk):
             if not confirm:
                 return
 
+        # meta is already retrieved
+        quantize = self.quantize_var.get()
+        grids = GRID_PRESETS[self.grid_var.get()]
+        ghosts = self.ghosts_var.get()
+        shift = self.shift_var.get()
+
+        # Instrument Overrides
+        bass_idx_ovr = -1
+        guitar_idx_ovr = -1
+
+        if not self.auto_detect_var.get():
+            # Helper to extract index from string "2: Track Name"
+            def get_idx(val):
+                if not val or val == "None": return -1
+                try:
+                    return int(val.split(":")[0])
+                except:
+                    return -1
+
+            bass_idx_ovr = get_idx(self.cbo_bass.get())
+            guitar_idx_ovr = get_idx(self.cbo_guitar.get())
+
+        kwargs = dict(quantize=quantize, include_ghosts=ghosts,
+                      bass_idx=bass_idx_ovr, guitar_idx=guitar_idx_ovr,
+                      audio_path=self.audio_path,
+                      shift_chart=shift, quantize_grids=grids,
+                      drum_kit=self.drum_kits[self.kit_var.get()])
+
+        # Convert off the Tk thread so the window keeps repainting; the form stays locked until it ends
+        self._cancel_event.clear()
+        self.btn_run.configure(state="disabled")
+        self.btn_cancel.configure(state="normal")
+        self.progress_bar.set(0)
+        threading.Thread(target=self._run_worker, args=(self.midi_path, meta, self.output_dir, kwargs),
+                         daemon=True).start()
+        self.after(50, self._poll_worker)
+
+    def _run_worker(self, midi_path, meta, output_dir, kwargs):
+        """Runs on the worker thread: never touches widgets, only posts to the queue."""
+        def progress(stage, fraction):
+            if self._cancel_event.is_set():
+                raise ConversionCancelled()
+            self._worker_queue.put(("progress", stage, fraction))
+
         try:
-            # meta is already retrieved
-            quantize = self.quantize_var.get()
-            ghosts = self.ghosts_var.get()
-            shift = self.shift_var.get()
-            
-            # Instrument Overrides
-            bass_idx_ovr = -1
-            guitar_idx_ovr = -1
-            
-            if not self.auto_detect_var.get():
-                # Helper to extract index from string "2: Track Name"
-                def get_idx(val):
-                    if not val or val == "None": return -1
-                    try:
-                        return int(val.split(":")[0])
-                    except:
-                        return -1
-                
-                bass_idx_ovr = get_idx(self.cbo_bass.get())
-                guitar_idx_ovr = get_idx(self.cbo_guitar.get())
-
-            folder = self.converter.process_song(
-                self.midi_path, meta, self.output_dir, 
-                quantize=quantize, include_ghosts=ghosts,
-                bass_idx=bass_idx_ovr, guitar_idx=guitar_idx_ovr,
-                audio_path=self.audio_path,
-                shift_chart=shift
-            )
-            
+            folder = self.converter.process_song(midi_path, meta, output_dir, progress=progress, **kwargs)
+            self._worker_queue.put(("done", folder))
+        except ConversionCancelled:
+            self._worker_queue.put(("cancelled",))
+        except Exception as e:
+            self._worker_queue.put(("error", str(e)))
+
+    def _poll_worker(self):
+        finished = None
+        while True:
+            try:
+                msg = self._worker_queue.get_nowait()
+            except queue.Empty:
+                break
+            if msg[0] == "progress":
+                _, stage, fraction = msg
+                self.progress_bar.set(fraction)
+                self.lbl_stage.configure(text=stage.capitalize())
+            else:
+                finished = msg
+
+        if finished is None:
+            self.after(50, self._poll_worker)
+            return
+
+        self.btn_run.configure(state="normal")
+        self.btn_cancel.configure(state="disabled")
+
+        if finished[0] == "done":
+            self.lbl_stage.configure(text="Done")
             msg = (f"Chart generated successfully!\n\n"
-                   f"Output Location:\n{folder}\n\n"
+                   f"Output Location:\n{finished[1]}\n\n"
                    "Next Step: Add your audio file (song.ogg) to this folder.")
-            
+
             messagebox.showinfo("Success", msg)
-        except Exception as e:
-            messagebox.showerror("Error", f"An error occurred:\n{str(e)}")
+        elif finished[0] == "cancelled":
+            self.progress_bar.set(0)
+            self.lbl_stage.configure(text="Cancelled")
+        else:
+            self.lbl_stage.configure(text="Failed")
+            messagebox.showerror("Error", f"An error occurred:\n{finished[1]}")
+
+    def _cancel_chart(self):
+        # Honoured at the next stage boundary
+        self._cancel_event.set()
+        self.btn_cancel.configure(state="disabled")
+        self.lbl_stage.configure(text="Cancelling...")
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support() # Worker processes of the packaged executable
     app = App()
-    app.mainloop()
\ No newline at end of file
+    app.mainloop()
+    app.converter.close()
\ No newline at end of file
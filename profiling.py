@@ -0,0 +1,114 @@
+import json
+import time
+import tracemalloc
+from typing import Any, Dict, Iterable, List, Optional
+
+
+class StageProfiler:
+    """
+    Opt-in instrumentation for MidiToYARGConverter.process_song(profiler=...).
+
+    Records wall time and produced event count for every conversion stage, grouped per song.
+    A stage lasts until the next one starts.
+    With trace_memory the peak traced memory is recorded too, but tracemalloc slows the
+    conversion down several times: measure time and memory in separate runs.
+    One profiler can follow many songs in a row; reports are plain dicts ready for JSON.
+    """
+
+    def __init__(self, trace_memory: bool = False):
+        self.trace_memory = trace_memory
+        self._tracing = False # tracemalloc was started by this profiler
+        self.songs: List[Dict[str, Any]] = []
+        self._song: Optional[Dict[str, Any]] = None
+        self._stage: Optional[Dict[str, Any]] = None
+        self._song_start = 0.0
+        self._stage_start = 0.0
+        self._song_peak = 0
+
+    def begin_song(self, name: str) -> None:
+        # A song left open by a failed conversion is dropped
+        self._song = {"song": name, "stages": []}
+        self._stage = None
+        self._song_peak = 0
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._tracing = True
+        self._song_start = time.perf_counter()
+
+    def stage(self, name: str) -> None:
+        if self._song is None:
+            return
+        self._close_stage()
+        self._stage = {"stage": name, "events": 0}
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        self._stage_start = time.perf_counter()
+
+    def add_events(self, count: int) -> None:
+        if self._stage is not None:
+            self._stage["events"] += int(count)
+
+    def end_song(self, cache_hit: bool = False) -> Dict[str, Any]:
+        """
+        Closes the current song and returns its report.
+        """
+        self._close_stage()
+        song = self._song
+        song["seconds"] = time.perf_counter() - self._song_start
+        song["events"] = sum(s["events"] for s in song["stages"])
+        song["peak_bytes"] = self._song_peak
+        song["cache_hit"] = cache_hit
+        self.songs.append(song)
+        self._song = None
+        self.close()
+        return song
+
+    def close(self) -> None:
+        """
+        Stops tracemalloc if this profiler started it (end_song does this; call it after a failed song).
+        """
+        if self._tracing:
+            tracemalloc.stop()
+            self._tracing = False
+
+    def report(self) -> Dict[str, Any]:
+        return {"songs": self.songs, "stages": aggregate(self.songs)}
+
+    def write(self, path: str) -> None:
+        with open(path, "w", encoding="utf-8") as fh:
+            json.dump(self.report(), fh, indent=2)
+
+    def _close_stage(self) -> None:
+        if self._stage is None:
+            return
+        self._stage["seconds"] = time.perf_counter() - self._stage_start
+        if self.trace_memory:
+            self._stage["peak_bytes"] = tracemalloc.get_traced_memory()[1]
+            self._song_peak = max(self._song_peak, self._stage["peak_bytes"])
+        self._song["stages"].append(self._stage)
+        self._stage = None
+
+
+def aggregate(songs: Iterable[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """
+    Per-stage totals over many song reports (e.g. a whole batch), slowest stages first.
+    Each entry keeps the song where that stage took the longest.
+    """
+    stages: Dict[str, Dict[str, Any]] = {}
+    for song in songs:
+        for s in song["stages"]:
+            entry = stages.setdefault(s["stage"], {
+                "runs": 0, "seconds": 0.0, "events": 0, "max_seconds": 0.0,
+                "slowest_song": None, "peak_bytes": 0,
+            })
+            entry["runs"] += 1
+            entry["seconds"] += s["seconds"]
+            entry["events"] += s["events"]
+            entry["peak_bytes"] = max(entry["peak_bytes"], s.get("peak_bytes", 0))
+            if s["seconds"] >= entry["max_seconds"]:
+                entry["max_seconds"] = s["seconds"]
+                entry["slowest_song"] = song["song"]
+
+    for entry in stages.values():
+        entry["mean_seconds"] = entry["seconds"] / entry["runs"]
+    return dict(sorted(stages.items(), key=lambda kv: kv[1]["seconds"], reverse=True))
@@ -0,0 +1,221 @@
+import struct
+from typing import Iterable, Iterator, Optional, Tuple
+
+import numpy as np
+
+
+# Event kinds shared with converter.EVENT_DTYPE
+KIND_OFF = 0
+KIND_ON = 1
+
+META_TEXT = 0x01
+META_TRACK_NAME = 0x03
+META_SET_TEMPO = 0x51
+META_TIME_SIGNATURE = 0x58
+META_END_OF_TRACK = 0x2F
+MAX_DELTA = 0x0FFFFFFF # Largest delta time a Standard MIDI File can hold (4-byte VLQ)
+_END_OF_TRACK = b"\x00\xff\x2f\x00"
+
+# iter_events tuple: (tick, delta, status, data1, data2, payload)
+TrackEvent = Tuple[int, int, int, int, int, Optional[bytes]]
+
+
+def read_vlq(data: bytes, pos: int) -> Tuple[int, int]:
+    """
+    Decodes a variable-length quantity at pos. Returns (value, position after it).
+    """
+    value = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value = (value << 7) | (byte & 0x7F)
+        if not byte & 0x80:
+            return value, pos
+
+
+def read_header(data: bytes) -> Tuple[int, int, int]:
+    """
+    Parses the MThd chunk. Returns (format, ticks_per_beat, offset of the first track chunk).
+    """
+    if data[:4] != b"MThd":
+        raise ValueError("Not a Standard MIDI File (missing MThd header)")
+    if len(data) < 14:
+        raise ValueError("Truncated MIDI file")
+    length, fmt, _, division = struct.unpack(">IHHH", data[4:14])
+    if division & 0x8000:
+        raise ValueError("SMPTE time division is not supported")
+    return fmt, division, 8 + length
+
+
+def iter_track_chunks(data: bytes, pos: int) -> Iterator[Tuple[int, int]]:
+    """
+    Yields (start, end) byte ranges of each MTrk chunk body, skipping unknown chunks
+    by their length without looking inside them. Raises ValueError when a chunk is cut short.
+    """
+    while pos + 8 <= len(data):
+        kind = data[pos:pos + 4]
+        length = struct.unpack(">I", data[pos + 4:pos + 8])[0]
+        start = pos + 8
+        end = start + length
+        if end > len(data):
+            raise ValueError("Truncated MIDI file")
+        if kind == b"MTrk":
+            yield start, end
+        pos = end
+
+
+def iter_events(data: bytes, pos: int, end: int) -> Iterator[TrackEvent]:
+    """
+    Decodes the events of one MTrk chunk body (see iter_track_chunks) with running status
+    resolved, as (absolute tick, delta, status, data1, data2, payload):
+    - channel messages: their data bytes, data2 is 0 for program change and channel pressure
+    - meta events: status 0xFF, the meta type in data1 and the payload bytes
+    - sysex: status 0xF0/0xF7 and the payload bytes
+    Stops after end_of_track. Raises IndexError on truncated data and ValueError on an
+    event running past end or a data byte with no running status in effect.
+    """
+    tick = 0
+    running = 0
+    while pos < end:
+        delta, pos = read_vlq(data, pos)
+        tick += delta
+
+        status = data[pos]
+        if status & 0x80:
+            pos += 1
+        elif running:
+            status = running # Running status: data byte follows the delta directly
+        else:
+            raise ValueError(f"data byte without running status at offset {pos}")
+
+        if status == 0xFF:
+            meta_type = data[pos]
+            length, pos = read_vlq(data, pos + 1)
+            if pos + length > end:
+                raise ValueError("Truncated MIDI file")
+            yield tick, delta, status, meta_type, 0, data[pos:pos + length]
+            if meta_type == META_END_OF_TRACK:
+                return
+            pos += length
+        elif status >= 0xF0:
+            length, pos = read_vlq(data, pos)
+            if pos + length > end:
+                raise ValueError("Truncated MIDI file")
+            yield tick, delta, status, 0, 0, data[pos:pos + length]
+            pos += length
+        else:
+            running = status
+            size = 1 if 0xC0 <= status < 0xE0 else 2
+            if pos + size > end:
+                raise ValueError("Truncated MIDI file")
+            yield tick, delta, status, data[pos], data[pos + 1] if size == 2 else 0, None
+            pos += size
+
+
+def encode_vlq(value: int) -> bytes:
+    """
+    MIDI variable-length quantity: 7 bits per byte, high bit set on all but the last.
+    """
+    out = [value & 0x7F]
+    value >>= 7
+    while value:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    return bytes(reversed(out))
+
+
+class TrackWriter:
+    """
+    Encodes one MTrk chunk straight into a byte buffer, with delta times and running status.
+    Events must be added in tick order. The end_of_track event is added by chunk(),
+    so a finished writer can be cached and written again.
+    """
+
+    def __init__(self, name: Optional[str] = None):
+        self.data = bytearray()
+        self.events = 0
+        self.tick = 0
+        self._running = None # Last channel status byte, reset by meta events
+        if name is not None:
+            self.meta(0, META_TRACK_NAME, name.encode("latin-1"))
+
+    def meta(self, tick: int, type_: int, payload: bytes) -> None:
+        self._delta(tick)
+        self.data += bytes((0xFF, type_)) + encode_vlq(len(payload)) + payload
+        self._running = None
+        self.events += 1
+
+    def text(self, tick: int, text: str) -> None:
+        self.meta(tick, META_TEXT, text.encode("latin-1"))
+
+    def set_tempo(self, tick: int, tempo: int) -> None:
+        self.meta(tick, META_SET_TEMPO, tempo.to_bytes(3, "big"))
+
+    def time_signature(self, tick: int, numerator: int, denominator: int,
+                       clocks_per_click: int = 24, notated_32nd_notes_per_beat: int = 8) -> None:
+        payload = bytes((numerator, denominator.bit_length() - 1, clocks_per_click, notated_32nd_notes_per_beat))
+        self.meta(tick, META_TIME_SIGNATURE, payload)
+
+    def notes(self, ticks: np.ndarray, kinds: np.ndarray, notes: np.ndarray, velocities: np.ndarray,
+              channel: int = 0) -> None:
+        """
+        Appends a batch of note_on/note_off events (sorted by tick) in one vectorized pass.
+        """
+        n = len(ticks)
+        if not n:
+            return
+
+        ticks = np.asarray(ticks, dtype=np.int64)
+        deltas = np.diff(ticks, prepend=self.tick)
+        np.maximum(deltas, 0, out=deltas)
+        if deltas.max() > MAX_DELTA:
+            raise ValueError(f"Delta time too large for a MIDI file: {int(deltas.max())} ticks (max {MAX_DELTA})")
+
+        status = np.where(np.asarray(kinds) == KIND_ON, 0x90 | channel, 0x80 | channel).astype(np.uint8)
+        previous = np.empty(n, dtype=np.int16)
+        previous[0] = -1 if self._running is None else self._running
+        previous[1:] = status[:-1]
+        has_status = (status != previous).astype(np.int64)
+
+        # Bytes per delta (a 28-bit VLQ is at most 4 bytes)
+        vlq_len = 1 + (deltas >= 1 << 7) + (deltas >= 1 << 14) + (deltas >= 1 << 21)
+        sizes = vlq_len + has_status + 2
+        starts = np.cumsum(sizes) - sizes
+        out = np.zeros(int(sizes.sum()), dtype=np.uint8)
+
+        for k in range(4):
+            rows = vlq_len > k
+            shift = 7 * (vlq_len[rows] - 1 - k)
+            cont = np.where(k < vlq_len[rows] - 1, 0x80, 0)
+            out[starts[rows] + k] = ((deltas[rows] >> shift) & 0x7F) | cont
+
+        pos = starts + vlq_len
+        out[pos[has_status == 1]] = status[has_status == 1]
+        pos += has_status
+        out[pos] = notes
+        out[pos + 1] = velocities
+
+        self.data += out.tobytes()
+        self.tick = int(ticks[-1])
+        self._running = int(status[-1])
+        self.events += n
+
+    def chunk(self) -> bytes:
+        data = bytes(self.data) + _END_OF_TRACK
+        return b"MTrk" + struct.pack(">I", len(data)) + data
+
+    def _delta(self, tick: int) -> None:
+        delta = max(0, tick - self.tick)
+        if delta > MAX_DELTA:
+            raise ValueError(f"Delta time too large for a MIDI file: {delta} ticks (max {MAX_DELTA})")
+        self.data += encode_vlq(delta)
+        self.tick = max(tick, self.tick)
+
+
+def encode_file(ticks_per_beat: int, tracks: Iterable[TrackWriter]) -> bytes:
+    """
+    Type 1 Standard MIDI File bytes for the given tracks.
+    """
+    chunks = [t.chunk() for t in tracks]
+    header = b"MThd" + struct.pack(">IHHH", 6, 1, len(chunks), ticks_per_beat)
+    return header + b"".join(chunks)
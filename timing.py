@@ -0,0 +1,135 @@
+from bisect import bisect_right
+from typing import List, Tuple
+
+import numpy as np
+from mido import MetaMessage
+
+
+DEFAULT_TEMPO = 500000 # Microseconds per beat (120 BPM) until the first set_tempo
+
+
+def time_signatures(tempo_events: List[Tuple[int, MetaMessage]]) -> List[Tuple[int, MetaMessage]]:
+    """
+    Time signature events sorted by tick, starting with a 4/4 default at tick 0 if needed.
+    """
+    ts_events = [x for x in tempo_events if x[1].type == "time_signature"]
+    ts_events.sort(key=lambda x: x[0])
+
+    # Default 4/4 if no initial event
+    if not ts_events or ts_events[0][0] > 0:
+        ts_events.insert(0, (0, MetaMessage("time_signature", numerator=4, denominator=4)))
+    return ts_events
+
+
+class TempoMap:
+    """
+    Tick <-> time conversions built once from the tempo track events.
+    Every lookup is a bisection over the tempo changes (O(log n)).
+    """
+
+    def __init__(self, tempo_events: List[Tuple[int, MetaMessage]], tpb: int):
+        self.tpb = tpb
+        self.time_signatures = time_signatures(tempo_events)
+
+        changes = sorted(((t, msg.tempo) for t, msg in tempo_events if msg.type == "set_tempo"), key=lambda x: x[0])
+        self._ticks = [0] + [t for t, _ in changes]
+        self._tempos = [DEFAULT_TEMPO] + [tempo for _, tempo in changes]
+
+        # Seconds elapsed at each tempo change
+        self._seconds = [0.0]
+        for i in range(1, len(self._ticks)):
+            span = self._ticks[i] - self._ticks[i - 1]
+            self._seconds.append(self._seconds[-1] + span * self._tempos[i - 1] / (tpb * 1e6))
+
+    def tempo_at(self, tick: int) -> int:
+        """
+        Microseconds per beat in effect at tick (the last set_tempo at or before it).
+        """
+        return self._tempos[self._index_at(tick)]
+
+    def tempos_at(self, ticks: np.ndarray) -> np.ndarray:
+        """
+        Vectorized tempo_at for an array of ticks.
+        """
+        idx = np.maximum(np.searchsorted(self._ticks, ticks, side="right") - 1, 0)
+        return np.asarray(self._tempos, dtype=np.int64)[idx]
+
+    def tick_to_seconds(self, tick: int) -> float:
+        i = self._index_at(tick)
+        return self._seconds[i] + (tick - self._ticks[i]) * self._tempos[i] / (self.tpb * 1e6)
+
+    def seconds_to_tick(self, seconds: float) -> float:
+        i = max(bisect_right(self._seconds, seconds) - 1, 0)
+        return self._ticks[i] + (seconds - self._seconds[i]) * self.tpb * 1e6 / self._tempos[i]
+
+    def bar_windows(self, end_tick: int, bars: int = 1) -> List[Tuple[int, int]]:
+        """
+        Splits [0, end_tick) into consecutive windows of `bars` bars each.
+        Adapts to Time Signature changes: a window never crosses a change, the next one starts on it.
+        """
+        ts_events = self.time_signatures
+
+        windows = [] # [(start_tick, end_tick), ...]
+        curr_t = 0
+        ts_idx = 0
+
+        # Generate windows covering the whole song duration
+        while curr_t < end_tick:
+            # Check if we moved into a new TS zone
+            if ts_idx + 1 < len(ts_events) and curr_t >= ts_events[ts_idx + 1][0]:
+                ts_idx += 1
+                curr_t = ts_events[ts_idx][0] # Snap to TS change
+
+            msg = ts_events[ts_idx][1]
+            # Calculate tick length of the window
+            # Ticks per Bar = tpb * (4 / denom) * numer
+            # Standard MIDI: tpb is ticks per quarter note
+            ticks_per_bar = int(self.tpb * 4 * msg.numerator / msg.denominator)
+            window_len = ticks_per_bar * bars
+
+            # Add windows until we hit next event or end
+            next_event_t = ts_events[ts_idx + 1][0] if ts_idx + 1 < len(ts_events) else float('inf')
+
+            while curr_t < next_event_t and curr_t < end_tick:
+                 effective_end = min(curr_t + window_len, next_event_t)
+
+                 if effective_end > curr_t:
+                     windows.append((curr_t, effective_end))
+                     curr_t += window_len
+                 else:
+                     curr_t = next_event_t
+
+        return windows
+
+    def beats(self, end_tick: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Ticks of every beat in [0, end_tick) and whether each one starts a bar.
+        A beat is one denominator note (an eighth in 6/8 and 7/8), and every time signature
+        change starts a new bar. Computed per signature segment, without stepping through beats.
+        """
+        ts_events = self.time_signatures
+        ticks, downbeats = [], []
+
+        for i, (start, msg) in enumerate(ts_events):
+            end = min(ts_events[i + 1][0] if i + 1 < len(ts_events) else end_tick, end_tick)
+            if end <= start:
+                continue # Replaced on the same tick, or past the end of the song
+
+            # Beat k is at start + k * 4 * tpb / denominator, rounded down (no drift with odd tpb)
+            per_beat = 4 * self.tpb
+            count = -(-(end - start) * msg.denominator // per_beat)
+            k = np.arange(count, dtype=np.int64)
+            ticks.append(start + k * per_beat // msg.denominator)
+            downbeats.append(k % msg.numerator == 0)
+
+        if not ticks:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=bool)
+        ticks, downbeats = np.concatenate(ticks), np.concatenate(downbeats)
+
+        # Beats shorter than a tick (tiny ticks_per_beat): keep the first one on each tick
+        keep = np.ones(len(ticks), dtype=bool)
+        keep[1:] = ticks[1:] != ticks[:-1]
+        return ticks[keep], downbeats[keep]
+
+    def _index_at(self, tick: int) -> int:
+        return max(bisect_right(self._ticks, tick) - 1, 0)
@@ -0,0 +1,226 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import Executor, Future, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError: # Optional: falls back to polling only
+    Observer = None
+
+
+POLL_INTERVAL = 2.0  # Seconds between folder scans (without watchdog, or while files settle)
+SETTLE_TIME = 3.0    # A file must keep the same size and mtime this long before it is converted
+STATE_FILE = ".watch-state.json" # In the output folder: inputs already converted
+
+# (midi size, midi mtime, audio size, audio mtime); audio fields are 0 without a .ogg
+Signature = Tuple[int, int, int, int]
+
+
+class FolderWatcher:
+    """
+    Converts every .mid dropped into a folder (with its matching .ogg, if any), forever.
+
+    New or changed files are converted once they stop changing for SETTLE_TIME, so
+    half-copied files are never read. At most `max_pending` conversions are queued
+    on the executor; the rest wait in the folder until a slot frees up.
+    Inputs already converted with the same options (kept in STATE_FILE) are skipped,
+    also across restarts.
+    When a worker process dies, the executor is replaced and the inputs it took down are
+    converted again one at a time; the one that kills a worker on its own is marked as failed.
+    on_result is called once per finished conversion (e.g. ChartCache.converted_elsewhere).
+    """
+
+    def __init__(self, source: str, output_dir: str, make_executor: Callable[[], Executor],
+                 make_job: Callable[[str], Dict[str, Any]],
+                 convert: Callable[[Dict[str, Any]], Tuple[str, bool, str, Any]],
+                 max_pending: int, options_key: str = "",
+                 poll_interval: float = POLL_INTERVAL, settle_time: float = SETTLE_TIME,
+                 on_result: Optional[Callable[[], None]] = None):
+        self.source = source
+        self.make_executor = make_executor
+        self.executor: Optional[Executor] = None # Created on the first submit and after a worker died
+        self.make_job = make_job
+        self.convert = convert
+        self.on_result = on_result
+        self.max_pending = max(max_pending, 1)
+        self.options_key = options_key
+        self.poll_interval = poll_interval
+        self.settle_time = settle_time
+
+        self.state_path = os.path.join(output_dir, STATE_FILE)
+        self.done = self._load_state() # midi path -> [options_key, signature]
+        self._settling: Dict[str, Tuple[Signature, float]] = {} # midi path -> (signature, first seen)
+        self._pending: Dict[Future, Tuple[str, Signature, Executor]] = {}
+        self._suspects: Set[str] = set() # Inputs that were running when a worker died: converted alone
+        self._wake = threading.Event()
+
+    def run(self, stop: Optional[threading.Event] = None) -> None:
+        """
+        Scans and converts until stop is set (or forever).
+        """
+        stop = stop or threading.Event()
+        observer = self._start_observer()
+        try:
+            while not stop.is_set():
+                self._collect_results()
+                self.poll()
+                # Wake early on a filesystem event, but keep polling while files settle
+                timeout = self.poll_interval if (self._settling or self._pending or observer is None) else None
+                self._wake.wait(timeout)
+                self._wake.clear()
+        finally:
+            if observer:
+                observer.stop()
+                observer.join()
+            wait(list(self._pending))
+            self._collect_results()
+            if self.executor:
+                self.executor.shutdown()
+                self.executor = None
+
+    def poll(self) -> List[str]:
+        """
+        One scan: submits the settled, changed inputs while there is room. Returns them.
+        """
+        now = time.monotonic()
+        busy = {path for path, _, _ in self._pending.values()}
+        submitted = []
+        if busy & self._suspects:
+            return submitted # A suspect runs alone
+
+        for midi_path in self._midi_files():
+            if midi_path in busy:
+                continue
+            try:
+                sig = self._signature(midi_path)
+            except OSError:
+                continue # Deleted or renamed while scanning
+
+            if self.done.get(midi_path) == [self.options_key, list(sig)]:
+                self._settling.pop(midi_path, None)
+                continue
+
+            seen = self._settling.get(midi_path)
+            if seen is None or seen[0] != sig:
+                self._settling[midi_path] = (sig, now) # New or still being written
+                continue
+            if now - seen[1] < self.settle_time:
+                continue
+
+            # Backpressure: leave it for a later scan when the queue is full
+            if len(self._pending) >= self.max_pending:
+                break
+            suspect = midi_path in self._suspects
+            if suspect and self._pending:
+                continue # Waits until nothing else runs
+            job = self.make_job(midi_path)
+            try:
+                future = self._executor().submit(self.convert, job)
+            except BrokenProcessPool:
+                # A worker died since the last round: its futures are collected on the next one
+                self._replace_executor(self.executor)
+                future = self._executor().submit(self.convert, job)
+            del self._settling[midi_path]
+            future.add_done_callback(lambda _: self._wake.set())
+            self._pending[future] = (midi_path, sig, self.executor)
+            submitted.append(midi_path)
+            if suspect:
+                break
+
+        return submitted
+
+    def _collect_results(self) -> None:
+        finished = [f for f in self._pending if f.done()]
+        for future in finished:
+            midi_path, sig, executor = self._pending.pop(future)
+            try:
+                _, ok, detail, _ = future.result()
+            except BrokenProcessPool:
+                self._replace_executor(executor)
+                if midi_path not in self._suspects:
+                    # Maybe only taken down with the crashing input: convert it again, alone
+                    self._suspects.add(midi_path)
+                    continue
+                ok, detail = False, "BrokenProcessPool: the worker process died"
+            self._suspects.discard(midi_path)
+            if self.on_result:
+                self.on_result()
+            if ok:
+                print(f"[ok]   {midi_path} -> {detail}", flush=True)
+            else:
+                print(f"[fail] {midi_path}: {detail}", flush=True)
+            # Failed inputs are recorded too: they are retried once the file changes
+            self.done[midi_path] = [self.options_key, list(sig)]
+        if finished:
+            self._save_state()
+
+    def _executor(self) -> Executor:
+        if self.executor is None:
+            self.executor = self.make_executor()
+        return self.executor
+
+    def _replace_executor(self, executor: Executor) -> None:
+        # The next submit starts a new one; futures of the broken executor are all done
+        if self.executor is executor:
+            executor.shutdown(wait=False)
+            self.executor = None
+
+    def _midi_files(self) -> List[str]:
+        paths = []
+        for root, _, files in os.walk(self.source):
+            for f in sorted(files):
+                if f.lower().endswith(".mid"):
+                    paths.append(os.path.join(root, f))
+        return paths
+
+    def _signature(self, midi_path: str) -> Signature:
+        midi = os.stat(midi_path)
+        audio_path = os.path.splitext(midi_path)[0] + ".ogg"
+        try:
+            audio = os.stat(audio_path)
+            return midi.st_size, midi.st_mtime_ns, audio.st_size, audio.st_mtime_ns
+        except OSError:
+            return midi.st_size, midi.st_mtime_ns, 0, 0
+
+    def _start_observer(self):
+        if Observer is None:
+            return None
+
+        wake = self._wake
+
+        class Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                wake.set()
+
+        observer = Observer()
+        observer.schedule(Handler(), self.source, recursive=True)
+        observer.start()
+        return observer
+
+    def _load_state(self) -> Dict[str, List[Any]]:
+        try:
+            with open(self.state_path, encoding="utf-8") as fh:
+                return json.load(fh)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_state(self) -> None:
+        os.makedirs(os.path.dirname(self.state_path) or ".", exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(self.state_path) or ".", suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as fh:
+            json.dump(self.done, fh, indent=1)
+        os.replace(tmp, self.state_path)
+
+
+def options_key(options: Dict[str, Any]) -> str:
+    """
+    Short digest of the conversion options: changing them converts everything again.
+    """
+    return hashlib.sha256(json.dumps(options, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:16]